@@ -8,6 +8,7 @@ from dataclasses import dataclass
 
 from src.conversation_manager import ConversationManager
 from src.agent import QAAgent
+from src.search import search_priority, INTERACTIVE
 
 st.set_page_config(
     # page_title="Open-Omnisearch Demo",
@@ -96,24 +97,44 @@ if prompt:
     if image:
         col1_message.chat_message(USER).image(image)
 
-    with st.spinner("Please wait.."):
-        answer, _, thought_info = st.session_state['client'].manage_conversation(
-            input_question=prompt,
-            image_url=image,
-            idx="test"
-        )
-        st.session_state[MESSAGES].append(Message(actor=ASSISTANT, payload=answer, image=""))
-        col1_message.chat_message(ASSISTANT).write(answer)
-
-    for idx, (thought, search, sub_q) in enumerate(zip(thought_info['thoughts'],
-                                                       thought_info['search'],
-                                                       thought_info['sub_questions'])):
-        col2_message.write(f"🤔🤔行动链 {idx + 1}")
-        col2_message.write(f":red[思考: {thought}]")
-        if "http" in search[:5]:
-            col2_message.write(f":green[搜索动作: 图片搜索]")
-            col2_message.image(search)
-        else:
-            col2_message.write(f":green[搜索动作: 搜索文字]")
-            col2_message.write(search)
-        col2_message.write(f":blue[子问题: {sub_q}]")
+    answer = ""
+    chain_idx = 0
+    live_output = None
+    partial = ""
+    # 交互请求的搜索优先于同一进程中的批量任务
+    with st.spinner("Please wait.."), search_priority(INTERACTIVE):
+        # 边生成边展示思考过程：模型输出的文本片段先实时显示，解析出思考 / 子问题 / 搜索后再结构化展示
+        for event in st.session_state['client'].iter_conversation(input_question=prompt,
+                                                                  image_url=image,
+                                                                  idx="test"):
+            if event["type"] == "token":
+                if live_output is None:
+                    live_output = col2_message.empty()
+                    partial = ""
+                partial += event["content"]
+                live_output.markdown(partial)
+                continue
+
+            if live_output is not None:
+                live_output.empty()
+                live_output = None
+
+            if event["type"] == "thought":
+                chain_idx += 1
+                col2_message.write(f"🤔🤔行动链 {chain_idx}")
+                col2_message.write(f":red[思考: {event['content']}]")
+            elif event["type"] == "sub_question":
+                col2_message.write(f":blue[子问题: {event['content']}]")
+            elif event["type"] == "search":
+                search = event["content"]
+                if "http" in search[:5]:
+                    col2_message.write(f":green[搜索动作: 图片搜索]")
+                    col2_message.image(search)
+                else:
+                    col2_message.write(f":green[搜索动作: 搜索文字]")
+                    col2_message.write(search)
+            elif event["type"] == "answer":
+                answer = event["content"]
+
+    st.session_state[MESSAGES].append(Message(actor=ASSISTANT, payload=answer, image=""))
+    col1_message.chat_message(ASSISTANT).write(answer)
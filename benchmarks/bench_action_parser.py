@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: single-pass parse_action vs. the previous substring scans + extract_query regexes.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_action_parser [--corpus benchmarks/data/react_outputs.jsonl] [--repeat 2000]
+"""
+import re
+import json
+import argparse
+import timeit
+
+from src.action_parser import parse_action, RETRIEVAL_SEARCH_TYPES
+
+
+def legacy_extract_query(answer, retrieval_type):
+    extract_pattern = f"(?<={retrieval_type})([\\s\\S]*?)(?=\n)"
+    query = re.search(extract_pattern, answer, re.DOTALL)
+    return query.group(1).strip() if query else ''
+
+
+def legacy_parse(answer):
+    """The per-turn work ConversationManager used to do on each model output"""
+    thought = legacy_extract_query(answer, "<Thought>\n")
+    sub_question, search_type, query, final_answer = "", None, None, None
+    if any(phrase in answer for phrase in RETRIEVAL_SEARCH_TYPES):
+        sub_question = legacy_extract_query(answer, "<Sub-Question>\n")
+        if "Image Retrieval with Input Image" in answer:
+            search_type = 'img_search_img'
+        elif "Text Retrieval" in answer:
+            search_type, query = 'text_search_text', legacy_extract_query(answer, 'Text Retrieval')
+        elif "Image Retrieval with Text Query" in answer:
+            search_type, query = 'text_search_img', legacy_extract_query(answer, 'Image Retrieval with Text Query')
+    if "Final Answer" in answer:
+        final_answer = answer.split("Final Answer:")[-1].strip()
+    return thought, sub_question, search_type, query, final_answer
+
+
+def check_equivalence(corpus):
+    for answer in corpus:
+        thought, sub_question, search_type, query, final_answer = legacy_parse(answer)
+        action = parse_action(answer)
+        assert action.thought == thought, (answer, action)
+        assert action.sub_question == sub_question, (answer, action)
+        assert action.search_type == search_type, (answer, action)
+        # the legacy query kept the leading ": " after the retrieval phrase
+        assert (action.query or '') == (query or '').lstrip(':').strip(), (answer, action)
+        assert action.final_answer == final_answer, (answer, action)
+
+
+def main(corpus_path, repeat):
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        corpus = [json.loads(line)["output"] for line in f if line.strip()]
+
+    check_equivalence(corpus)
+
+    for name, parse in (("legacy substring + regex", legacy_parse), ("parse_action", parse_action)):
+        seconds = min(timeit.repeat(lambda: [parse(answer) for answer in corpus], number=repeat, repeat=3))
+        per_call = seconds / (repeat * len(corpus)) * 1e6
+        print(f"{name:<28} {per_call:8.2f} us/output  ({len(corpus)} outputs x {repeat})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ReAct 输出解析的微基准测试")
+    parser.add_argument("--corpus", type=str, default="benchmarks/data/react_outputs.jsonl", help="模型输出语料")
+    parser.add_argument("--repeat", type=int, default=2000, help="每轮重复次数")
+    args = parser.parse_args()
+
+    main(args.corpus, args.repeat)
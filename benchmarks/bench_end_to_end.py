@@ -0,0 +1,139 @@
+"""
+End-to-end throughput benchmark against the offline stand-ins in benchmarks/fakes.py.
+
+Runs src.main.main over a synthetic dataset in serial, threaded and async modes, with Ollama,
+OpenAI and DuckDuckGo replaced by local fakes, and reports questions/sec plus per-stage
+latency percentiles from the tracing spans. The openai mode measures raw call_gpt
+throughput against the fake /v1/chat/completions endpoint.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_end_to_end [--questions 40] [--modes serial,threaded,async] [--workers 8]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from benchmarks.fakes import FakeServer, install_fake_ddgs, add_arguments, config_from_args
+from src import caption_cache, conversation_manager, tracing
+from src.llm_config import OpenaiApiLlmService, call_gpt
+from src.main import main as run_main
+from src.search import SearchConfig, SearchFactory, vector_index
+from src.singleflight import singleflight_stats
+
+MODES = ("serial", "threaded", "async", "openai")
+
+
+def write_dataset(path, questions, image_base_url):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(questions):
+            f.write(json.dumps({"question_id": f"bench-{i}",
+                                "question": f"Benchmark question {i}: what is shown in the image?",
+                                "image_url": f"{image_base_url}/img/question-{i}.png"}) + "\n")
+
+
+def reset_state():
+    """Drop per-process caches so every mode starts cold"""
+    caption_cache._caption_cache = None
+    conversation_manager._search_service = None
+    conversation_manager._async_search_service = None
+    SearchFactory.clear()
+    vector_index._vector_index = None
+
+
+def run_pipeline(mode, args, dataset, out_dir):
+    reset_state()
+    trace_path = os.path.join(out_dir, f"trace-{mode}.jsonl")
+    tracing.configure_tracing(True, trace_path)
+    workers = args.workers if mode == "threaded" else 1
+    concurrency = args.workers if mode == "async" else 0
+
+    start = time.perf_counter()
+    run_main(dataset, f"bench-{mode}", out_dir, workers=workers, async_concurrency=concurrency,
+             prefix_cache=args.prefix_cache, speculative=args.speculative and mode != "async",
+             early_stop=args.early_stop and mode != "async")
+    elapsed = time.perf_counter() - start
+    tracing.configure_tracing(False)
+
+    with open(os.path.join(out_dir, f"bench-{mode}", "output_from_llm.jsonl"), "r", encoding="utf-8") as f:
+        answered = sum(1 for line in f if line.strip())
+    return answered, elapsed, tracing.summarize([trace_path])
+
+
+def run_openai(args, base_url):
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    service = OpenaiApiLlmService(model="fake")
+    messages = [{"role": "user", "content": f"Benchmark question {i}"} for i in range(args.questions)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda item: call_gpt([item[1]], item[0], service), enumerate(messages)))
+    elapsed = time.perf_counter() - start
+    return sum(1 for result in results if result[0]), elapsed, []
+
+
+def print_report(mode, questions, answered, elapsed, rows):
+    print(f"\n== {mode}: {answered}/{questions} answered in {elapsed:.2f}s "
+          f"({answered / elapsed:.2f} questions/s)")
+    if rows:
+        print("{:<16} {:>7} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms"))
+        for row in rows:
+            print("{:<16} {:>7} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(*row[:7]))
+
+
+def main(args):
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    config = config_from_args(args)
+    server = FakeServer(config).start()
+    install_fake_ddgs(config, server.url)
+    qps = args.search_qps
+    SearchConfig().set("search_qps", {"text": qps, "image": qps} if qps > 0 else {})
+    SearchConfig().set("vector_index", args.vector_index)
+    # QAAgent 构造时读取 OLLAMA_HOST
+    os.environ["OLLAMA_HOST"] = server.url
+
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix="omnisearch-bench-")
+    os.makedirs(out_dir, exist_ok=True)
+    dataset = os.path.join(out_dir, "dataset.jsonl")
+    write_dataset(dataset, args.questions, server.url)
+    print(f"Fake services on {server.url}, outputs in {out_dir}")
+
+    try:
+        for mode in args.modes.split(","):
+            if mode not in MODES:
+                raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+            if mode == "openai":
+                answered, elapsed, rows = run_openai(args, server.url)
+            else:
+                answered, elapsed, rows = run_pipeline(mode, args, dataset, out_dir)
+            print_report(mode, args.questions, answered, elapsed, rows)
+    finally:
+        server.stop()
+
+    print("\nrequests served:", dict(sorted(config.stats.items())))
+    print("single-flight:", singleflight_stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用离线替身服务的端到端吞吐基准测试")
+    parser.add_argument("--questions", type=int, default=40, help="合成数据集的问题数")
+    parser.add_argument("--modes", type=str, default="serial,threaded,async", help="逗号分隔，可选 " + ",".join(MODES))
+    parser.add_argument("--workers", type=int, default=8, help="threaded / async / openai 模式的并发数")
+    parser.add_argument("--prefix_cache", action="store_true", help="同 main.py 的 --prefix_cache")
+    parser.add_argument("--speculative", action="store_true", help="同 main.py 的 --speculative（仅同步模式）")
+    parser.add_argument("--early_stop", action="store_true", help="同 main.py 的 --early_stop（仅同步模式）")
+    parser.add_argument("--search_qps", type=float, default=0, help="每种搜索类型的 DDGS QPS 上限，0 表示不限制")
+    parser.add_argument("--vector_index", action="store_true", help="开启本地向量索引（SearchConfig['vector_index']）")
+    parser.add_argument("--out_dir", type=str, default=None, help="输出目录，默认新建临时目录")
+    parser.add_argument("--log_level", type=str, default="WARNING", help="loguru 日志级别")
+    add_arguments(parser)
+
+    main(parser.parse_args())
@@ -0,0 +1,397 @@
+"""
+Offline stand-ins for the services the pipeline talks to, for benchmarking without network.
+
+- FakeServer: a local HTTP server implementing Ollama's /api/chat (used both by the raw
+  HTTP path and by ollama.Client) and /api/embed, OpenAI's /v1/chat/completions (plain and
+  SSE streaming) and /img/<name>.png, which serves the images returned by the fake image search.
+- FakeDDGS: an in-process double of duckduckgo_search.DDGS (text / images), installed
+  with install_fake_ddgs().
+
+Model replies come from canned ReAct transcripts; latencies are log-normal and every
+endpoint has a configurable failure rate.
+
+Run a server for a separate process (e.g. `OLLAMA_HOST=http://127.0.0.1:11500 python -m src.main ...`):
+    python -m benchmarks.fakes --port 11500 --llm_ms 300 --token_ms 5
+"""
+import io
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from PIL import Image
+
+DEFAULT_TRANSCRIPTS = "benchmarks/data/react_transcripts.jsonl"
+CAPTION = "A photo of an old stone building with a clock tower."
+SUMMARY = "The retrieved documents say the building was completed in 1874 and restored in 1998."
+
+
+class Latency:
+    """Log-normal latency: median_ms is the median, sigma the log standard deviation (0 = fixed)"""
+    def __init__(self, median_ms: float = 0.0, sigma: float = 0.0, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._random = random.Random(seed)
+
+    def sample(self) -> float:
+        """Draw one latency in seconds"""
+        if self.median_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median_ms / 1000
+        return self._random.lognormvariate(0.0, self.sigma) * self.median_ms / 1000
+
+    def sleep(self) -> None:
+        if (seconds := self.sample()) > 0:
+            time.sleep(seconds)
+
+
+class FakeConfig:
+    """Behaviour shared by the fake LLM endpoints and the DDGS double
+
+    Args:
+        transcripts: ReAct transcripts, each a list of assistant turns
+        llm_latency: Time to first token of every chat request
+        token_ms: Extra latency per generated token (4 characters)
+        llm_failure_rate: Probability that a chat request fails with HTTP 500
+        search_latency: Latency of every DDGS call
+        search_failure_rate: Probability that a DDGS call raises a rate-limit error
+        image_size: Side length of the generated images in pixels
+        image_failure_rate: Probability that an image URL is a dead link (HTTP 404)
+    """
+    def __init__(self,
+                 transcripts: List[List[str]],
+                 llm_latency: Optional[Latency] = None,
+                 token_ms: float = 0.0,
+                 llm_failure_rate: float = 0.0,
+                 search_latency: Optional[Latency] = None,
+                 search_failure_rate: float = 0.0,
+                 image_size: int = 256,
+                 image_failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.transcripts = transcripts
+        self.llm_latency = llm_latency or Latency()
+        self.token_ms = token_ms
+        self.llm_failure_rate = llm_failure_rate
+        self.search_latency = search_latency or Latency()
+        self.search_failure_rate = search_failure_rate
+        self.image_size = image_size
+        self.image_failure_rate = image_failure_rate
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images = {}
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_TRANSCRIPTS, **kwargs) -> "FakeConfig":
+        with open(path, "r", encoding="utf-8") as f:
+            transcripts = [json.loads(line)["turns"] for line in f if line.strip()]
+        return cls(transcripts, **kwargs)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def should_fail(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    @staticmethod
+    def _text(content) -> str:
+        # OpenAI vision messages carry a list of parts
+        if isinstance(content, list):
+            return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+
+    def reply(self, messages: List[dict]) -> str:
+        """Choose the canned reply for a chat request
+
+        Captioning and summarization requests are recognised by their prompt; otherwise
+        the transcript is picked by a hash of the first user message (the question) and
+        the turn by the number of assistant messages so far.
+        """
+        last = self._text(messages[-1].get("content")) if messages else ""
+        if last == "What is this?":
+            return CAPTION
+        if last.startswith("Below are related documents"):
+            return SUMMARY
+
+        question = next((self._text(msg.get("content")) for msg in messages if msg.get("role") == "user"), "")
+        transcript = self.transcripts[int(hashlib.md5(question.encode("utf-8")).hexdigest(), 16)
+                                      % len(self.transcripts)]
+        turn = sum(1 for msg in messages if msg.get("role") == "assistant")
+        return transcript[min(turn, len(transcript) - 1)]
+
+    @staticmethod
+    def embed(text: str, dim: int = 256) -> List[float]:
+        """A hashed bag-of-words vector, so texts sharing words are similar"""
+        vector = [0.0] * dim
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+        return vector
+
+    def image(self, name: str) -> bytes:
+        """A deterministic PNG whose colour depends on the name"""
+        with self._lock:
+            data = self._images.get(name)
+        if data is None:
+            color = tuple(hashlib.md5(name.encode("utf-8")).digest()[:3])
+            buffer = io.BytesIO()
+            Image.new("RGB", (self.image_size, self.image_size), color).save(buffer, format="PNG")
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[name] = data
+        return data
+
+
+def _chunks(text: str, size: int = 4):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        config = self.server.config
+        if self.path.startswith("/img/"):
+            config.count("image")
+            if config.should_fail(config.image_failure_rate):
+                config.count("image failed")
+                self._send(404, b"")
+            else:
+                self._send(200, config.image(self.path[len("/img/"):]), "image/png")
+        else:
+            self._send(404, b"{}")
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/embed":
+            config.count(self.path)
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send(200, json.dumps({"model": body.get("model", ""),
+                                        "embeddings": [config.embed(text) for text in texts]}).encode())
+            return
+        if self.path not in ("/api/chat", "/v1/chat/completions"):
+            self._send(404, b"{}")
+            return
+
+        config.count(self.path)
+        config.llm_latency.sleep()
+        if config.should_fail(config.llm_failure_rate):
+            config.count(self.path + " failed")
+            self._send(500, json.dumps({"error": "injected failure"}).encode())
+            return
+
+        answer = config.reply(body.get("messages", []))
+        chunks = _chunks(answer)
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        try:
+            if self.path == "/api/chat":
+                self._ollama(body, chunks, prompt_tokens)
+            else:
+                self._openai(body, chunks, prompt_tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled generation (early stop)
+            config.count(self.path + " cancelled")
+
+    def _generate(self, chunks):
+        token_seconds = self.server.config.token_ms / 1000
+        for chunk in chunks:
+            if token_seconds:
+                time.sleep(token_seconds)
+            yield chunk
+
+    def _ollama(self, body, chunks, prompt_tokens):
+        usage = {"prompt_eval_count": prompt_tokens, "eval_count": len(chunks),
+                 "prompt_eval_duration": 0, "eval_duration": 0, "load_duration": 0, "total_duration": 0}
+        base = {"model": body.get("model", ""), "created_at": "1970-01-01T00:00:00Z"}
+        if body.get("stream", True):
+            self._start_stream("application/x-ndjson")
+            for chunk in self._generate(chunks):
+                line = {**base, "message": {"role": "assistant", "content": chunk}, "done": False}
+                self._write_chunk(json.dumps(line).encode() + b"\n")
+            final = {**base, "message": {"role": "assistant", "content": ""}, "done": True,
+                     "done_reason": "stop", **usage}
+            self._write_chunk(json.dumps(final).encode() + b"\n")
+            self._end_stream()
+            return
+
+        answer = "".join(self._generate(chunks))
+        response = {**base, "message": {"role": "assistant", "content": answer}, "done": True,
+                    "done_reason": "stop", **usage}
+        self._send(200, json.dumps(response).encode())
+
+    def _openai(self, body, chunks, prompt_tokens):
+        base = {"id": "chatcmpl-fake", "created": 0, "model": body.get("model", "")}
+        if body.get("stream"):
+            self._start_stream("text/event-stream")
+            for chunk in self._generate(chunks):
+                event = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_stream()
+            return
+
+        answer = "".join(self._generate(chunks))
+        response = {**base, "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(chunks),
+                              "total_tokens": prompt_tokens + len(chunks)}}
+        self._send(200, json.dumps(response).encode())
+
+
+class FakeServer(ThreadingHTTPServer):
+    """Local HTTP server for the fake Ollama / OpenAI endpoints and search-result images"""
+    daemon_threads = True
+
+    def __init__(self, config: FakeConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients drop keep-alive connections, e.g. after cancelling a stream
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FakeDDGS:
+    """In-process double of duckduckgo_search.DDGS; configure it through install_fake_ddgs()"""
+    config: FakeConfig = None
+    image_base_url: str = ""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def _call(self, name: str) -> None:
+        from duckduckgo_search.exceptions import RatelimitException
+
+        self.config.count(name)
+        self.config.search_latency.sleep()
+        if self.config.should_fail(self.config.search_failure_rate):
+            self.config.count(name + " failed")
+            raise RatelimitException("injected failure")
+
+    def text(self, keywords: str, region: str = "wt-wt", safesearch: str = "moderate",
+             timelimit=None, backend: str = "api", max_results: Optional[int] = None) -> List[dict]:
+        self._call("ddgs.text")
+        return [{"title": f"{keywords} ({i})",
+                 "href": f"https://example.org/{i}",
+                 "body": f"Document {i} about {keywords}. " + SUMMARY}
+                for i in range(max_results or 5)]
+
+    def images(self, keywords: str, region: str = "wt-wt", safesearch: str = "moderate",
+               timelimit=None, size=None, color=None, type_image=None, layout=None,
+               license_image=None, max_results: Optional[int] = None) -> List[dict]:
+        self._call("ddgs.images")
+        slug = hashlib.md5(keywords.encode("utf-8")).hexdigest()[:12]
+        return [{"title": f"{keywords} ({i})",
+                 "image": f"{self.image_base_url}/img/{slug}-{i}.png",
+                 "thumbnail": f"{self.image_base_url}/img/{slug}-{i}.png",
+                 "url": f"https://example.org/{slug}/{i}",
+                 "height": self.config.image_size,
+                 "width": self.config.image_size,
+                 "source": "fake"}
+                for i in range(max_results or 5)]
+
+
+def install_fake_ddgs(config: FakeConfig, image_base_url: str) -> None:
+    """Replace DDGS in the search strategies with FakeDDGS"""
+    from src.search import search_strategy
+
+    FakeDDGS.config = config
+    FakeDDGS.image_base_url = image_base_url
+    search_strategy.DDGS = FakeDDGS
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--transcripts", type=str, default=DEFAULT_TRANSCRIPTS, help="ReAct 对话脚本")
+    parser.add_argument("--llm_ms", type=float, default=200, help="模型首个 token 延迟的中位数（毫秒）")
+    parser.add_argument("--llm_sigma", type=float, default=0.3, help="模型延迟的对数标准差")
+    parser.add_argument("--token_ms", type=float, default=2, help="每个 token 的生成延迟（毫秒）")
+    parser.add_argument("--llm_failure", type=float, default=0.0, help="模型请求返回 500 的概率")
+    parser.add_argument("--search_ms", type=float, default=300, help="DDGS 延迟的中位数（毫秒）")
+    parser.add_argument("--search_sigma", type=float, default=0.5, help="DDGS 延迟的对数标准差")
+    parser.add_argument("--search_failure", type=float, default=0.0, help="DDGS 调用被限流的概率")
+    parser.add_argument("--image_failure", type=float, default=0.0, help="图片链接失效（返回 404）的概率")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig.from_file(args.transcripts,
+                                llm_latency=Latency(args.llm_ms, args.llm_sigma, args.seed),
+                                token_ms=args.token_ms,
+                                llm_failure_rate=args.llm_failure,
+                                search_latency=Latency(args.search_ms, args.search_sigma, args.seed + 1),
+                                search_failure_rate=args.search_failure,
+                                image_failure_rate=args.image_failure,
+                                seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动离线的 Ollama / OpenAI 替身服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeServer(config_from_args(args), args.host, args.port)
+    print(f"Serving fake Ollama / OpenAI endpoints on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
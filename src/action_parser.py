@@ -0,0 +1,135 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+
+__all__ = ["Action",
+           "parse_action",
+           "StreamingActionParser",
+           "RETRIEVAL_SEARCH_TYPES"]
+
+
+# 检索动作及其对应的搜索类型，顺序即优先级
+RETRIEVAL_SEARCH_TYPES = {
+    "Image Retrieval with Input Image": "img_search_img",
+    "Text Retrieval": "text_search_text",
+    "Image Retrieval with Text Query": "text_search_img",
+}
+
+# 一次扫描即可定位所有段落标记与检索动作
+_TOKEN_PATTERN = re.compile(
+    r"<Thought>\n|<Sub-Question>\n|Final Answer|"
+    + "|".join(re.escape(phrase) for phrase in RETRIEVAL_SEARCH_TYPES)
+)
+
+
+@dataclass
+class Action:
+    """模型一轮 ReAct 输出的结构化解析结果"""
+    thought: str = ""
+    sub_question: str = ""
+    action_type: Optional[str] = None
+    search_type: Optional[str] = None
+    # "Image Retrieval with Input Image" 的查询需要先生成图片描述，此时为 None
+    query: Optional[str] = None
+    final_answer: Optional[str] = None
+
+    @property
+    def is_retrieval(self) -> bool:
+        return self.action_type is not None
+
+    @property
+    def is_final(self) -> bool:
+        return self.final_answer is not None
+
+
+def _rest_of_line(text: str, start: int) -> str:
+    end = text.find("\n", start)
+    return text[start:] if end < 0 else text[start:end]
+
+
+def parse_action(answer: str) -> Action:
+    """
+    单次扫描解析模型输出，得到思考、子问题、检索动作、查询语句与最终答案。
+    各标记取首次出现的位置；同时出现多个检索动作时按 RETRIEVAL_SEARCH_TYPES 的顺序取优先者；
+    最终答案取最后一个 "Final Answer:" 之后的内容。
+    """
+    first = {}
+    has_final = False
+    for match in _TOKEN_PATTERN.finditer(answer):
+        token = match.group()
+        if token == "Final Answer":
+            has_final = True
+        elif token not in first:
+            first[token] = match.end()
+
+    action = Action()
+    if "<Thought>\n" in first:
+        action.thought = _rest_of_line(answer, first["<Thought>\n"]).strip()
+    if "<Sub-Question>\n" in first:
+        action.sub_question = _rest_of_line(answer, first["<Sub-Question>\n"]).strip()
+
+    for phrase, search_type in RETRIEVAL_SEARCH_TYPES.items():
+        if phrase in first:
+            action.action_type = phrase
+            action.search_type = search_type
+            if search_type != "img_search_img":
+                action.query = _rest_of_line(answer, first[phrase]).strip().lstrip(":").strip()
+            break
+
+    if has_final:
+        action.final_answer = answer.rpartition("Final Answer:")[2].strip()
+    return action
+
+
+class StreamingActionParser:
+    """
+    增量解析模型的流式 ReAct 输出。
+    一旦出现完整的 <Search> 动作行或 Final Answer 行，feed 返回 True，调用方即可取消生成，
+    避免模型在发出检索动作后继续编造 Observation 浪费解码时间。
+    text 为截止到该动作行（含换行）的输出，之后幻觉出的内容会被丢弃。
+    """
+    MARKERS = ("<Search>", "Final Answer:")
+
+    def __init__(self):
+        self._buffer = ""
+        self._content_from = None
+        self._end = None
+
+    @property
+    def done(self) -> bool:
+        return self._end is not None
+
+    @property
+    def text(self) -> str:
+        return self._buffer if self._end is None else self._buffer[:self._end]
+
+    def feed(self, chunk: str) -> bool:
+        if self._end is not None:
+            return True
+
+        # 只扫描新增部分，回退一个标记长度以覆盖跨片段的标记
+        scan_from = max(0, len(self._buffer) - max(len(marker) for marker in self.MARKERS))
+        self._buffer += chunk
+
+        if self._content_from is None:
+            positions = [(self._buffer.find(marker, scan_from), marker) for marker in self.MARKERS]
+            positions = [(pos, marker) for pos, marker in positions if pos >= 0]
+            if not positions:
+                return False
+            pos, marker = min(positions)
+            self._content_from = pos + len(marker)
+            scan_from = self._content_from
+        else:
+            scan_from = max(self._content_from, scan_from)
+
+        # 标记之后第一个以换行结束的非空行就是完整的动作 / 答案
+        line_start = self._content_from
+        while True:
+            newline = self._buffer.find("\n", max(line_start, scan_from))
+            if newline < 0:
+                return False
+            if self._buffer[line_start:newline].strip():
+                self._end = newline + 1
+                return True
+            line_start = newline + 1
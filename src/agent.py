@@ -1,10 +1,17 @@
 import os
 from dotenv import load_dotenv
 from .llm_config import *
+from .llm_cache import get_llm_cache
+from .singleflight import get_singleflight
 
 load_dotenv()
 
 
+def _copy_message(message):
+    """合并的请求共享同一个回答，每个调用方拿到各自的消息副本，避免对话之间相互修改"""
+    return dict(message) if isinstance(message, dict) else message
+
+
 class QAAgent:
     """负责处理问题并调用GPT模型生成回答"""
     def __init__(self,
@@ -14,8 +21,37 @@ class QAAgent:
         self.client = OllamaVisionService(host, model, **kwargs)
 
     def ask_gpt(self, messages, idx):
-        success, idx, message, answer = call_gpt(
-            messages, idx, self.client
-        )
-            
-        return success, idx, message, answer
+        # 相同的请求（如重复检索后的同一个总结提示）正在进行时，等待其结果而不是重复请求
+        key = get_llm_cache().make_key(messages, self.client)
+        # 合并到其他请求时没有消耗 token，先清空统计；发起请求时 call_gpt 会重新记录
+        reset_last_usage()
+        success, _, message, answer = get_singleflight("ask_gpt").do(
+            key, lambda: call_gpt(messages, idx, self.client)
+        )[:4]
+
+        return success, idx, _copy_message(message), answer
+
+    def ask_gpt_stream(self, messages, idx, parser=None):
+        """
+        流式版本：逐段 yield 生成的文本，生成器返回 (success, idx, message, answer)。
+        传入 StreamingActionParser 时，解析到完整的动作行后立即停止生成。
+        """
+        return (yield from stream_gpt(messages, idx, self.client, parser))
+
+
+class AsyncQAAgent:
+    """QAAgent 的异步版本，可在单个事件循环中并发处理多个对话"""
+    def __init__(self,
+                 host="http://localhost:11434",
+                 model="llama3.2-vision:11b-instruct-q4_K_M",
+                 **kwargs):
+        self.client = AsyncOllamaVisionService(host, model, **kwargs)
+
+    async def ask_gpt(self, messages, idx):
+        key = get_llm_cache().make_key(messages, self.client)
+        reset_last_usage()
+        success, _, message, answer = (await get_singleflight("ask_gpt").do_async(
+            key, lambda: async_call_gpt(messages, idx, self.client)
+        ))[:4]
+
+        return success, idx, _copy_message(message), answer
@@ -0,0 +1,83 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from .search import SearchConfig, SearchCache
+
+
+__all__ = ["CaptionCache",
+           "get_caption_cache"]
+
+
+class CaptionCache:
+    """
+    输入图片描述（"What is this?"）的缓存，键为图片内容哈希 + 模型名称。
+    内存中是一个 LRU，设置 persist_path 时再加一层 SQLite 持久化（跨进程、跨运行共享）。
+    """
+    def __init__(self, max_entries: int = 1024, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._persistent = None
+        if persist_path:
+            self._persistent = SearchCache(persist_path, ttl=None, table='captions')
+
+    @staticmethod
+    def make_key(image, model: str) -> Optional[str]:
+        """无法取得图片字节（如空图片）时返回 None，表示不缓存"""
+        if isinstance(image, io.BytesIO):
+            data = image.getvalue()
+        elif isinstance(image, bytes):
+            data = image
+        elif isinstance(image, (str, Path)) and image and os.path.isfile(image):
+            data = Path(image).read_bytes()
+        else:
+            return None
+        if not data:
+            return None
+        return f"{model}:{hashlib.sha256(data).hexdigest()}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            caption = self._memory.get(key)
+            if caption is not None:
+                self._memory.move_to_end(key)
+                return caption
+
+        if self._persistent is not None:
+            caption = self._persistent.get(key)
+            if caption is not None:
+                self._remember(key, caption)
+            return caption
+        return None
+
+    def set(self, key: str, caption: str) -> None:
+        self._remember(key, caption)
+        if self._persistent is not None:
+            self._persistent.set(key, caption)
+
+    def _remember(self, key: str, caption: str) -> None:
+        with self._lock:
+            self._memory[key] = caption
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+_caption_cache = None
+_caption_cache_lock = threading.Lock()
+
+
+def get_caption_cache() -> CaptionCache:
+    global _caption_cache
+    if _caption_cache is None:
+        with _caption_cache_lock:
+            if _caption_cache is None:
+                config = SearchConfig()
+                _caption_cache = CaptionCache(config.get('caption_cache_size', 1024),
+                                              config.get('caption_cache_path'))
+    return _caption_cache
@@ -1,97 +1,309 @@
-import re
-import requests
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import Tuple, List
 from loguru import logger
 
 from .prompt import *
-from .search import SearchService
+from .message_store import MessageStore
+from .llm_config import get_last_usage
+from .caption_cache import get_caption_cache
+from .action_parser import Action, StreamingActionParser, parse_action
+from .search import SearchService, AsyncSearchService, get_http_client
+from .tracing import span, start_trace, current_spans
+
 
 # Initialize the search service as a module-level singleton
 _search_service = None
+_async_search_service = None
+_search_service_lock = threading.Lock()
 
 
 def get_search_service():
     global _search_service
     if _search_service is None:
-        _search_service = SearchService()
+        with _search_service_lock:
+            if _search_service is None:
+                _search_service = SearchService()
     return _search_service
 
 
+# 推测执行（speculative 模式）使用的共享线程池
+_speculation_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative")
+
+
+def get_async_search_service():
+    global _async_search_service
+    if _async_search_service is None:
+        # 先在锁外取得同步服务：get_search_service 也会获取同一把（不可重入的）锁
+        search_service = get_search_service()
+        with _search_service_lock:
+            if _async_search_service is None:
+                _async_search_service = AsyncSearchService(search_service)
+    return _async_search_service
+
+
 class ConversationManager:
-    def __init__(self, qa_agent, dataset_name, save_path):
+    def __init__(self, qa_agent, dataset_name, save_path, prefix_cache=False, speculative=False, early_stop=False):
+        """
+        prefix_cache: 复用 Ollama KV cache 的模式。固定的系统提示作为独立的 system 消息放在最前，
+            对话历史只追加不修改，使每轮请求的前缀保持不变；同时在 thought_info['usage']
+            中记录每轮的 prompt_eval / eval token 数，用于确认前缀复用是否生效
+            （与 early_stop 同时开启时，提前停止的轮次没有 token 数，只记为 {"early_stopped": True}）。
+            建议同时为 QAAgent 设置 keep_alive，并让 Ollama 的 OLLAMA_NUM_PARALLEL 大于 1，
+            避免图片描述、文档摘要等旁路请求挤占主对话的缓存槽位。
+        speculative: 推测检索模式（仅同步流程）。对话开始时就在后台为输入图片生成描述；
+            每轮以流式方式调用模型，一旦解析出完整的 <Search> 动作行就在后台开始检索，
+            与模型剩余的生成并行。之后的检索步骤直接使用这些 future，不再把这些延迟放在关键路径上。
+        early_stop: （仅同步流程）对话主循环以流式方式调用模型，并增量解析输出；一旦出现完整的 <Search> 动作行
+            或 Final Answer 行就取消生成并立即进入检索，省去模型继续编造 Observation 的解码时间。
+        """
         self.qa_agent = qa_agent
         self.dataset_name = dataset_name
         self.save_path = save_path
+        self.prefix_cache = prefix_cache
+        self.speculative = speculative
+        self.early_stop = early_stop
         self.conversation_num = 0
         self.total_image_quota = 9
+        self._prefetched = {}
+        # 预取回调在线程池中执行，替换 / 读写 _prefetched 时需要加锁
+        self._prefetch_lock = threading.Lock()
 
     def manage_conversation(self, input_question, image_url, idx):
+        for event in self.iter_conversation(input_question, image_url, idx, stream=False):
+            pass
+        return event["content"], event["messages"], event["thought_info"]
+
+    def iter_conversation(self, input_question, image_url, idx, stream=True):
+        """
+        以事件流的形式运行对话，便于界面实时展示思考过程。依次产生的事件：
+            {"type": "token", "content": 文本片段}       模型正在生成的部分回答（stream=True 时）
+            {"type": "thought", "content": 思考}
+            {"type": "sub_question", "content": 子问题}
+            {"type": "search", "content": 图片 url 或检索到的文本}
+            {"type": "answer", "content": 最终回答, "messages": 会话记录, "thought_info": 思考信息}
+        最后一个事件总是 answer。
+        开启追踪（见 tracing.configure_tracing）时，各阶段的 span 记录在 thought_info['trace'] 中。
+        """
+        # 同一个 ConversationManager 会依次处理多条数据，每次对话开始时重置轮数与图片配额
         self.conversation_num = 0
-        if isinstance(image_url, str) and "http" in image_url[:5]:
-            image_url = BytesIO(requests.get(image_url).content)
-
-        messages = [
-            {
-                "role": "user",
-                "content": sys_prompt_1.format(input_question),
-                "images": [image_url]
-            }
-        ]
+        self.total_image_quota = 9
+        with start_trace("conversation", question_id=str(idx)):
+            if isinstance(image_url, str) and "http" in image_url[:5]:
+                with span("image_download", source="input"):
+                    image_url = BytesIO(get_http_client().get(image_url).content)
+
+            self._start_speculation(image_url, idx)
+            try:
+                yield from self._conversation_events(input_question, image_url, idx, stream)
+            finally:
+                self._stop_speculation()
+
+    def _ask_events(self, messages, idx, stream):
+        """调用模型；stream=True 时把生成的文本片段作为 token 事件产生，返回 ask_gpt 的结果"""
+        with span("react", turn=self.conversation_num):
+            # 开启 early_stop 时解析到动作行就会停止生成并立即检索，无需另外预取
+            watcher = StreamingActionParser() if self.speculative and not self.early_stop else None
+            if not stream and not self.early_stop and watcher is None:
+                return self.qa_agent.ask_gpt(messages, idx)
+
+            parser = StreamingActionParser() if self.early_stop else None
+            tokens = self.qa_agent.ask_gpt_stream(messages, idx, parser)
+            while True:
+                try:
+                    content = next(tokens)
+                except StopIteration as stop:
+                    return stop.value
+                if watcher is not None and not watcher.done and watcher.feed(content):
+                    self._prefetch_action(parse_action(watcher.text), idx)
+                if stream:
+                    yield {"type": "token", "content": content}
+
+    def _conversation_events(self, input_question, image_url, idx, stream):
+        messages = self._initial_messages(input_question, image_url)
         current_message = messages
 
-        thought_info = {"thoughts": [], "search": [], "sub_questions": []}
+        thought_info = self._new_thought_info()
 
-        success, idx, message, answer = self.qa_agent.ask_gpt(messages, idx)
+        success, idx, message, answer = yield from self._ask_events(messages, idx, stream)
+        self._record_usage(thought_info)
+        action = parse_action(answer)
 
-        thought_info['thoughts'].append(self.extract_query(answer, "<Thought>\n"))
+        yield {"type": "thought", "content": self._record_thought(thought_info, action)}
 
         while self.conversation_num < 5:
-            if any(phrase in answer
-                   for phrase in
-                   ["Image Retrieval with Input Image", "Text Retrieval", "Image Retrieval with Text Query"]):
-                tmp_d = {"role": "assistant"}
-                tmp_d.update(message)
-                current_message.append(tmp_d)
-                sub_question = self.extract_query(answer, "<Sub-Question>\n")
-                search_images, search_text = self.handle_retrieval(answer, image_url, idx)
-
-                thought_info['sub_questions'].append(sub_question)
-                if search_images:
-                    thought_info['search'].append(search_images[0][0])
-                else:
-                    thought_info['search'].append("\n".join(search_text))
+            if action.is_retrieval:
+                self._append_assistant(current_message, message)
+                sub_question = action.sub_question
+                yield {"type": "sub_question", "content": sub_question}
+                search_images, search_text = self.handle_retrieval(action, image_url, idx)
+
+                self._record_retrieval(thought_info, sub_question, search_images, search_text)
+                yield {"type": "search", "content": thought_info['search'][-1]}
 
                 contents = self.prepare_contents(search_images, messages, sub_question, idx, search_text, image_url)
-                new_item = {"role": "user", "content": "\n".join(contents["text"])}
-                if "images" in contents:
-                    new_item.update({"images": contents["images"]})
-                current_message.append(new_item)
+                current_message.append(self._contents_message(contents))
 
-                success, idx, message, answer = self.qa_agent.ask_gpt(current_message, idx)
+                success, idx, message, answer = yield from self._ask_events(current_message, idx, stream)
+                self._record_usage(thought_info)
                 logger.info("conversation step: {} {}".format(self.conversation_num, answer))
                 if not success:
                     logger.error("Request failed.")
                     break
+                action = parse_action(answer)
+
+                yield {"type": "thought", "content": self._record_thought(thought_info, action)}
+
+            if action.is_final:
+                yield self._answer_event(*self._final_answer(action, answer, message, current_message,
+                                                             thought_info))
+                return
+
+            logger.debug(self.conversation_num)
+            self.conversation_num += 1
+
+        yield self._answer_event(*self._conversation_over(answer, current_message, thought_info))
+
+    @staticmethod
+    def _answer_event(answer, current_message, thought_info):
+        return {"type": "answer", "content": answer, "messages": current_message, "thought_info": thought_info}
+
+    @staticmethod
+    def _new_thought_info():
+        thought_info = {"thoughts": [], "search": [], "sub_questions": []}
+        if (spans := current_spans()) is not None:
+            thought_info['trace'] = spans
+        return thought_info
+
+    @staticmethod
+    def _record_thought(thought_info, action):
+        thought_info['thoughts'].append(action.thought)
+        return action.thought
+
+    async def manage_conversation_async(self, input_question, image_url, idx):
+        """
+        manage_conversation 的异步版本，需要配合 AsyncQAAgent 使用，
+        以便单个事件循环可以同时驱动多个对话。
+        """
+        # 同一个 ConversationManager 会依次处理多条数据，每次对话开始时重置轮数与图片配额
+        self.conversation_num = 0
+        self.total_image_quota = 9
+        with start_trace("conversation", question_id=str(idx)):
+            if isinstance(image_url, str) and "http" in image_url[:5]:
+                with span("image_download", source="input"):
+                    response = await asyncio.to_thread(get_http_client().get, image_url)
+                image_url = BytesIO(response.content)
+
+            return await self._conversation_async(input_question, image_url, idx)
+
+    async def _conversation_async(self, input_question, image_url, idx):
+        messages = self._initial_messages(input_question, image_url)
+        current_message = messages
 
-            if "Final Answer" in answer:
-                # 生成一个字典 tmp_d，代表助手的角色，并将 message 内容添加到其中。
-                # 将 tmp_d 添加到 current_message 中以保留完整会话记录。
-                tmp_d = {"role": "assistant"}
-                tmp_d.update(message)
-                current_message.append(tmp_d)
-                logger.info(answer)
-                logger.info("-------")
-                logger.info(answer.split("Final Answer: ")[-1])
-                # 返回最终答案（去掉 Final Answer: 前缀）、当前会话状态
+        thought_info = self._new_thought_info()
 
-                logger.debug(f"{thought_info=}")
+        with span("react", turn=self.conversation_num):
+            success, idx, message, answer = await self.qa_agent.ask_gpt(messages, idx)
+        self._record_usage(thought_info)
+        action = parse_action(answer)
+
+        self._record_thought(thought_info, action)
+
+        while self.conversation_num < 5:
+            if action.is_retrieval:
+                self._append_assistant(current_message, message)
+                sub_question = action.sub_question
+                search_images, search_text = await self.handle_retrieval_async(action, image_url, idx)
 
-                return answer.split("Final Answer:")[-1].strip(), current_message, thought_info
+                self._record_retrieval(thought_info, sub_question, search_images, search_text)
+
+                contents = await self.prepare_contents_async(search_images, messages, sub_question, idx,
+                                                             search_text, image_url)
+                current_message.append(self._contents_message(contents))
+
+                with span("react", turn=self.conversation_num):
+                    success, idx, message, answer = await self.qa_agent.ask_gpt(current_message, idx)
+                self._record_usage(thought_info)
+                logger.info("conversation step: {} {}".format(self.conversation_num, answer))
+                if not success:
+                    logger.error("Request failed.")
+                    break
+                action = parse_action(answer)
+
+                self._record_thought(thought_info, action)
+
+            if action.is_final:
+                return self._final_answer(action, answer, message, current_message, thought_info)
 
             logger.debug(self.conversation_num)
             self.conversation_num += 1
 
+        return self._conversation_over(answer, current_message, thought_info)
+
+    def _initial_messages(self, input_question, image_url):
+        # MessageStore 缓存每条消息的编码，后续每轮只需编码新增的消息
+        if self.prefix_cache:
+            return MessageStore([
+                {
+                    "role": "system",
+                    "content": sys_prompt_1_prefix
+                },
+                {
+                    "role": "user",
+                    "content": sys_prompt_1_question.format(input_question),
+                    "images": [image_url]
+                }
+            ])
+        return MessageStore([
+            {
+                "role": "user",
+                "content": sys_prompt_1.format(input_question),
+                "images": [image_url]
+            }
+        ])
+
+    def _record_usage(self, thought_info):
+        if self.prefix_cache:
+            thought_info.setdefault('usage', []).append(get_last_usage())
+
+    @staticmethod
+    def _append_assistant(current_message, message):
+        tmp_d = {"role": "assistant"}
+        tmp_d.update(message)
+        current_message.append(tmp_d)
+
+    @staticmethod
+    def _record_retrieval(thought_info, sub_question, search_images, search_text):
+        thought_info['sub_questions'].append(sub_question)
+        if search_images:
+            thought_info['search'].append(search_images[0][0])
+        else:
+            thought_info['search'].append("\n".join(search_text))
+
+    @staticmethod
+    def _contents_message(contents):
+        new_item = {"role": "user", "content": "\n".join(contents["text"])}
+        if "images" in contents:
+            new_item.update({"images": contents["images"]})
+        return new_item
+
+    def _final_answer(self, action, answer, message, current_message, thought_info):
+        # 生成一个字典 tmp_d，代表助手的角色，并将 message 内容添加到其中。
+        # 将 tmp_d 添加到 current_message 中以保留完整会话记录。
+        self._append_assistant(current_message, message)
+        logger.info(answer)
+        logger.info("-------")
+        logger.info(action.final_answer)
+        # 返回最终答案（去掉 Final Answer: 前缀）、当前会话状态
+
+        logger.debug(f"{thought_info=}")
+
+        return action.final_answer, current_message, thought_info
+
+    def _conversation_over(self, answer, current_message, thought_info):
         logger.info(answer)
         logger.info(self.conversation_num)
         logger.info("OVER!")
@@ -100,105 +312,225 @@ class ConversationManager:
 
         return answer, current_message, thought_info
 
+    @staticmethod
+    def _retrieval_target(answer) -> Tuple[str, str]:
+        """
+        根据模型输出（字符串或已解析的 Action）确定检索类型与查询语句。
+        对于 "Image Retrieval with Input Image"，查询语句需要先通过图像描述得到，此时返回 None。
+        """
+        action = answer if isinstance(answer, Action) else parse_action(answer)
+        return action.search_type, action.query
+
+    @staticmethod
+    def _caption_messages(image_url):
+        # duckduckgo does not support reverse image search,
+        # so we use multimodal model to get the image caption first, and
+        # then do the search operation
+        return [
+            {
+                "role": "user",
+                "content": "What is this?",
+                "images": [image_url]
+            }
+        ]
+
+    def _caption_key(self, image_url):
+        model = getattr(getattr(self.qa_agent, "client", None), "model", "")
+        return get_caption_cache().make_key(image_url, model)
+
+    def _caption(self, image_url, idx):
+        # 同一张图片（同一模型）的描述只需要生成一次
+        with span("caption") as caption_span:
+            key = self._caption_key(image_url)
+            if key is not None and (caption := get_caption_cache().get(key)) is not None:
+                caption_span.set(cached=True)
+                return caption
+
+            success, idx, message, caption = self.qa_agent.ask_gpt(self._caption_messages(image_url), idx)
+            if success and key is not None:
+                get_caption_cache().set(key, caption)
+            return caption
+
+    async def _caption_async(self, image_url, idx):
+        with span("caption") as caption_span:
+            key = self._caption_key(image_url)
+            if key is not None and (caption := get_caption_cache().get(key)) is not None:
+                caption_span.set(cached=True)
+                return caption
+
+            success, idx, message, caption = await self.qa_agent.ask_gpt(self._caption_messages(image_url), idx)
+            if success and key is not None:
+                get_caption_cache().set(key, caption)
+            return caption
+
+    @staticmethod
+    def _prefetch_key(search_type, query):
+        # 忽略大小写、多余空白以及首尾的冒号、句号和问号
+        return search_type, ' '.join(query.strip(' :.?').lower().split())
+
+    def _start_speculation(self, image_url, idx):
+        prefetched = {}
+        with self._prefetch_lock:
+            self._prefetched = prefetched
+        if not self.speculative or not image_url:
+            return
+
+        # 只提前生成图片描述（不占用搜索配额）；以图搜图等到模型真正发出检索动作后再进行。
+        # 复制上下文，使后台任务的 span 记录在当前对话的 trace 中
+        caption = _speculation_executor.submit(contextvars.copy_context().run, self._caption, image_url, idx)
+        with self._prefetch_lock:
+            prefetched['caption'] = caption
+
+    def _stop_speculation(self):
+        with self._prefetch_lock:
+            prefetched, self._prefetched = self._prefetched, {}
+        for future in list(prefetched.values()):
+            future.cancel()
+
+    def _prefetch_action(self, action, idx):
+        """模型输出中刚出现完整的检索动作行时调用，在后台开始该动作的检索"""
+        if not action.is_retrieval or action.query is None:
+            return
+        with self._prefetch_lock:
+            prefetched = self._prefetched
+        self._prefetch(prefetched, action.search_type, action.query, idx)
+
+    def _prefetch(self, prefetched, search_type, query, idx):
+        """
+        在后台预取检索结果，conversation_num 记为 spec 以免与正式检索的图片文件重名。
+        prefetched 为发起预取的对话的 _prefetched：对话已结束（或已开始下一个对话）时不再预取。
+        """
+        key = self._prefetch_key(search_type, query)
+        with self._prefetch_lock:
+            if self._prefetched is not prefetched or key in prefetched:
+                return
+            prefetched[key] = _speculation_executor.submit(contextvars.copy_context().run,
+                                                           get_search_service().fine_search,
+                                                           query,
+                                                           search_type,
+                                                           self.save_path,
+                                                           self.dataset_name,
+                                                           idx,
+                                                           'spec')
+
+    def _take_prefetched(self, search_type, query):
+        with self._prefetch_lock:
+            future = self._prefetched.pop(self._prefetch_key(search_type, query), None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed, retrying on the critical path: {e}")
+            return None
+
+    def _speculative_caption(self, image_url, idx):
+        with self._prefetch_lock:
+            caption = self._prefetched.get('caption')
+        # 仍在线程池队列中尚未开始时取消并直接生成，避免排在其他对话的推测任务之后
+        if caption is not None and not caption.cancel():
+            try:
+                return caption.result()
+            except Exception as e:
+                logger.warning(f"Speculative caption failed, retrying on the critical path: {e}")
+        return self._caption(image_url, idx)
+
     def handle_retrieval(self, answer, image_url, idx) -> Tuple[List[Tuple[str, str]], List[str]]:
-        if "Image Retrieval with Input Image" in answer:
-            # duckduckgo does not support reverse image search,
-            # so we use multimodal model to get the image caption first, and
-            # then do the search operation
-            messages = [
-                {
-                    "role": "user",
-                    "content": "What is this?",
-                    "images": [image_url]
-                }
-            ]
-            success, idx, message, answer = self.qa_agent.ask_gpt(messages, idx)
+        search_type, query = self._retrieval_target(answer)
+        with span("retrieval", search_type=search_type, turn=self.conversation_num) as retrieval_span:
+            if query is None:
+                query = self._speculative_caption(image_url, idx)
 
-            return get_search_service().fine_search(answer,
-                                                    'img_search_img',
-                                                    self.save_path,
-                                                    self.dataset_name,
-                                                    idx,
-                                                    self.conversation_num)
+            if self.speculative and (prefetched := self._take_prefetched(search_type, query)) is not None:
+                retrieval_span.set(prefetched=True)
+                return prefetched
 
-        elif "Text Retrieval" in answer:
-            query = self.extract_query(answer, 'Text Retrieval')
             return get_search_service().fine_search(query,
-                                                    'text_search_text',
+                                                    search_type,
                                                     self.save_path,
                                                     self.dataset_name,
                                                     idx,
                                                     self.conversation_num)
 
-        elif "Image Retrieval with Text Query" in answer:
-            query = self.extract_query(answer, 'Image Retrieval with Text Query')
-            return get_search_service().fine_search(query,
-                                                    'text_search_img',
-                                                    self.save_path,
-                                                    self.dataset_name,
-                                                    idx,
-                                                    self.conversation_num)
+    async def handle_retrieval_async(self, answer, image_url, idx) -> Tuple[List[Tuple[str, str]], List[str]]:
+        search_type, query = self._retrieval_target(answer)
+        with span("retrieval", search_type=search_type, turn=self.conversation_num):
+            if query is None:
+                query = await self._caption_async(image_url, idx)
+
+            return await get_async_search_service().fine_search(query,
+                                                                search_type,
+                                                                self.save_path,
+                                                                self.dataset_name,
+                                                                idx,
+                                                                self.conversation_num)
+
+    def _image_contents(self, search_images, search_text):
+        # 断言失败的时候显示(search_text)
+        # assert len(search_images) == len(search_text), (search_text)
+        contents = {"text": ["Contents of retrieved images: "], "images": []}
+        use_imgs_num = min(5, self.total_image_quota)
+        self.total_image_quota -= use_imgs_num
+        for img, txt in zip(search_images[:use_imgs_num], search_text[:use_imgs_num]):
+            contents["text"].extend(["Description: " + txt])
+
+            if len(img) > 2 and img[2] is not None:
+                # 检索阶段已经下载好的原始图片字节，直接交给模型
+                img_item = img[2]
+            elif "http" in img[0][:5]:
+                img_item = BytesIO(get_http_client().get(img[0]).content)
+            else:
+                img_item = img[0]
 
-    def extract_query(self, answer, retrieval_type):
-        # the query based on the given retrieval type.
-        # For example, in the case of "Text Retrieval", we extract
-        # the query from the answer after "Text Retrieval:".
-        # In the case of "Image Retrieval with Text Query", we extract
-        # the query from the answer after "Image Retrieval with Text Query:".
-        # In the case of "Image Retrieval with Input Image", we extract
-        # the query from the answer after "Image Retrieval with Input Image:".
-        #
-        # Note: This is a simplified example and may not work for all cases.
-        # You may need to modify this based on the specific requirements of your project
-        extract_pattern = f"(?<={retrieval_type})([\s\S]*?)(?=\n)"
-        query = re.search(extract_pattern, answer, re.DOTALL)
-        if not query:
-            query = ''
-        else:
-            query = query.group(1).strip()
-        logger.debug(f"{answer=}\n{retrieval_type=}\n{query=}")
-        return query
+            contents["images"].extend([img_item])
 
-    def prepare_contents(self, search_images, messages, sub_question, idx, search_text, image_url):
-        if len(search_images) > 0:
-            # 断言失败的时候显示(search_text)
-            # assert len(search_images) == len(search_text), (search_text)
-            contents = {"text": ["Contents of retrieved images: "], "images": []}
-            use_imgs_num = min(5, self.total_image_quota)
-            self.total_image_quota -= use_imgs_num
-            for img, txt in zip(search_images[:use_imgs_num], search_text[:use_imgs_num]):
-                contents["text"].extend(["Description: " + txt])
+        return contents
 
-                if "http" in img[0][:5]:
-                    img_item = BytesIO(requests.get(img[0]).content)
-                else:
-                    img_item = img[0]
+    @staticmethod
+    def _summary_messages(sub_question, search_text, image_url):
+        contents = ["Below are related documents, which may be helpful for answering questions later on:"]
+        for txt in search_text:
+            contents.append(txt)
+        contents.append("\nWe also provide a related image.")
+        contents.append(sub_question + ' Answer:')
+        contents = '\n'.join(contents)
 
-                contents["images"].extend([img_item])
+        return [
+            {
+                "role": "user",
+                "content": contents,
+                "images": [image_url]
+            }
+        ]
 
+    @staticmethod
+    def _summary_contents(success, answer, search_text):
+        contents = {"text": ["Contents of retrieved documents: "]}
+        if success:
+            contents["text"].extend([answer])
         else:
-            contents = ["Below are related documents, which may be helpful for answering questions later on:"]
             for txt in search_text:
-                contents.append(txt)
-            contents.append("\nWe also provide a related image.")
-            contents.append(sub_question + ' Answer:')
-            contents = '\n'.join(contents)
+                contents["text"].extend([txt])
+        return contents
 
-            sub_messages = [
-                {
-                    "role": "user",
-                    "content": contents,
-                    "images": [image_url]
-                }
-            ]
+    def prepare_contents(self, search_images, messages, sub_question, idx, search_text, image_url):
+        if len(search_images) > 0:
+            with span("image_contents"):
+                return self._image_contents(search_images, search_text)
 
+        with span("summarize", documents=len(search_text)):
+            sub_messages = self._summary_messages(sub_question, search_text, image_url)
             success = True
             _, _, _, answer = self.qa_agent.ask_gpt(sub_messages, idx)
-            contents = {"text": ["Contents of retrieved documents: "]}
-            if success:
-                contents["text"].extend([answer])
-            else:
-                for txt in search_text:
-                    contents["text"].extend([txt])
+            return self._summary_contents(success, answer, search_text)
 
-        return contents
+    async def prepare_contents_async(self, search_images, messages, sub_question, idx, search_text, image_url):
+        if len(search_images) > 0:
+            with span("image_contents"):
+                return await asyncio.to_thread(self._image_contents, search_images, search_text)
+
+        with span("summarize", documents=len(search_text)):
+            sub_messages = self._summary_messages(sub_question, search_text, image_url)
+            success = True
+            _, _, _, answer = await self.qa_agent.ask_gpt(sub_messages, idx)
+            return self._summary_contents(success, answer, search_text)
@@ -0,0 +1,136 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from .message_store import MessageStore
+
+load_dotenv()
+
+
+__all__ = ["LLMCache",
+           "get_llm_cache",
+           "set_llm_cache"]
+
+
+class LLMCache:
+    """
+    LLM 请求的确定性缓存，用于基准测试复跑与回归测试。
+    以 (模型, 参数, 消息文本, 图片字节) 的哈希作为键，每条记录保存为一个 JSON 文件。
+
+    mode:
+        passthrough: 不读也不写缓存，直接请求服务
+        record: 请求服务并把结果写入缓存
+        replay: 只从缓存读取，未命中时报错，无需 Ollama / OpenAI 服务
+    """
+    MODES = ("passthrough", "record", "replay")
+
+    def __init__(self, cache_dir: str = ".llm_cache", mode: str = "passthrough"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported LLM cache mode: {mode}, expected one of {self.MODES}")
+        self.cache_dir = Path(cache_dir)
+        self.mode = mode
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("LLM_CACHE_DIR", ".llm_cache"),
+                   os.getenv("LLM_CACHE_MODE", "passthrough"))
+
+    @staticmethod
+    def _image_digest(image) -> str:
+        if isinstance(image, io.BytesIO):
+            data = image.getvalue()
+        elif isinstance(image, bytes):
+            data = image
+        elif isinstance(image, (str, Path)) and os.path.isfile(image):
+            data = Path(image).read_bytes()
+        else:
+            data = str(image).encode("utf-8")
+        return hashlib.sha256(data).hexdigest()
+
+    def _message_digests(self, messages):
+        # MessageStore 已经缓存了每条消息编码后的哈希，无需再次读取图片
+        if isinstance(messages, MessageStore):
+            return messages.digests()
+        return [
+            {
+                "role": msg.get("role"),
+                "content": msg.get("content"),
+                "images": [self._image_digest(img) for img in msg.get("images") or []],
+            }
+            for msg in messages
+        ]
+
+    def make_key(self, messages, llm_server) -> str:
+        payload = {
+            "service": type(llm_server).__name__,
+            "model": getattr(llm_server, "model", None),
+            "options": getattr(llm_server, "args", None),
+            "messages": self._message_digests(messages),
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Tuple[bool, dict, str]]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            record = json.load(f)
+        return record["success"], record["message"], record["answer"]
+
+    def save(self, key: str, success: bool, message, answer: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        record = {"success": success, "message": dict(message), "answer": answer}
+        # 先写临时文件再原子替换，多线程 / 多进程同时写入同一个键也是安全的
+        tmp_path = path.with_suffix(f".{os.getpid()}.{id(record)}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def lookup(self, messages, idx, llm_server):
+        """replay 模式下返回缓存结果，其余模式返回 (None, key)"""
+        if self.mode == "passthrough":
+            return None, None
+        key = self.make_key(messages, llm_server)
+        if self.mode == "replay":
+            cached = self.load(key)
+            if cached is None:
+                raise ValueError(f"LLM cache miss in replay mode for question {idx}: {key}")
+            success, message, answer = cached
+            return (success, idx, message, answer), key
+        return None, key
+
+    def store(self, key, result) -> None:
+        """record 模式下保存请求结果"""
+        if self.mode != "record" or key is None:
+            return
+        success, _, message, answer = result[:4]
+        try:
+            self.save(key, success, message, answer)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+
+_llm_cache = None
+
+
+def get_llm_cache() -> LLMCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache.from_env()
+    return _llm_cache
+
+
+def set_llm_cache(cache: LLMCache) -> None:
+    global _llm_cache
+    _llm_cache = cache
@@ -1,14 +1,18 @@
-import io
+import json
 import traceback
-from pathlib import Path
 import os
+from contextvars import ContextVar
 from typing import Tuple
 
 import requests
-import time
 from dotenv import load_dotenv
 from loguru import logger
 
+from .llm_cache import get_llm_cache
+from .message_store import MessageStore, raw_image_messages
+from .search import SearchConfig, Retry, get_http_client
+from .tracing import span
+
 load_dotenv()
 
 workers = 4
@@ -21,7 +25,41 @@ retry_attempt = 10
 __all__ = ["OpenaiApiLlmService",
            "OllamaService",
            "OllamaVisionService",
-           "call_gpt"]
+           "AsyncOllamaVisionService",
+           "call_gpt",
+           "stream_gpt",
+           "async_call_gpt",
+           "get_last_usage",
+           "reset_last_usage"]
+
+
+# 最近一次 LLM 调用的 token 统计，按线程 / asyncio 任务隔离
+_last_usage: ContextVar[dict] = ContextVar("last_usage", default={})
+USAGE_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+                "load_duration", "total_duration")
+
+
+def get_last_usage() -> dict:
+    """
+    返回当前线程 / 任务中最近一次 Ollama 调用的 token 统计，
+    prompt_eval_count 明显小于提示长度时说明服务端复用了 KV cache。
+    提前停止的流式调用收不到携带统计的最后一个片段，此时只有 {"early_stopped": True}。
+    """
+    return _last_usage.get()
+
+
+def reset_last_usage() -> None:
+    """清空当前线程 / 任务的 token 统计，如合并到其他请求、自身未消耗 token 时"""
+    _last_usage.set({})
+
+
+def _record_usage(response) -> None:
+    _last_usage.set({field: response.get(field) for field in USAGE_FIELDS if response.get(field) is not None})
+
+
+def _llm_retry(endpoint) -> Retry:
+    """LLM 请求的重试策略：指数退避 + 抖动、熔断与重试预算，见 search.resilience"""
+    return Retry(endpoint, max_attempts=SearchConfig().get('llm_max_retries', 8))
 
 
 class OpenaiApiLlmService:
@@ -38,6 +76,10 @@ class OpenaiApiLlmService:
         else:
             self.api_key = api_key
 
+        # 可指向兼容 OpenAI 接口的其他服务（如本地的离线基准测试替身）
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip('/')
+        self.endpoint = f"openai:{self.base_url}"
+
     def __call__(self, messages, idx):
         """
         调用 gpt 的 api 回答问题，包含了违规检查和内容过滤错误。
@@ -52,36 +94,89 @@ class OpenaiApiLlmService:
         }
 
         answer = None
+        retry = _llm_retry(self.endpoint)
         while answer is None:
             try:
-                r = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
+                retry.before_attempt()
+                r = get_http_client().post(
+                    f'{self.base_url}/chat/completions',
                     json=data,
-                    headers={"Authorization": f"Bearer {self.api_key}"}
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    timeout=SearchConfig().get('llm_timeout')
                 )
-                resp = r.json()
-
-                # 检查 API 响应的状态码与内容
+                # 检查 API 响应的状态码与内容；带上响应以便重试时遵循 429 / Retry-After
                 if r.status_code != 200:
-                    print("请求失败，重试中！")
-                    print(resp)
-                    continue
+                    raise requests.HTTPError(f"请求失败 {r.status_code}: {r.text}", response=r)
+                resp = r.json()
 
                 # 检查内容策略的相关代码
                 if 'choices' in resp and resp['choices'][0].get('finish_reason') in ['content_filter',
                                                                                      'ResponsibleAIPolicyViolation']:
                     print('内容不符合策略要求，返回空结果')
+                    retry.success()
                     return False, idx, "", "", 0, 0, 0
 
                 message = resp['choices'][0]['message']
                 answer = message['content']
 
+                retry.success()
                 return True, idx, message, answer
 
             except Exception as e:
                 logger.error(e)
                 logger.error('发生异常，重试中！')
-                time.sleep(1)  # 等待一段时间再重试
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
+                continue
+
+    def stream(self, messages, idx):
+        """
+        流式调用：逐段 yield 生成的文本，生成器的返回值与 __call__ 相同
+        """
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "n": 1,  # 回答数量
+            "max_tokens": 4096,
+            "stream": True
+        }
+
+        retry = _llm_retry(self.endpoint)
+        while True:
+            chunks = []
+            try:
+                retry.before_attempt()
+                for line in get_http_client().iter_lines(
+                    'POST',
+                    f'{self.base_url}/chat/completions',
+                    json=data,
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    timeout=SearchConfig().get('llm_timeout')
+                ):
+                    if not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        break
+                    choices = json.loads(payload).get('choices') or [{}]
+                    if choices[0].get('finish_reason') in ['content_filter', 'ResponsibleAIPolicyViolation']:
+                        print('内容不符合策略要求，返回空结果')
+                        retry.success()
+                        return False, idx, "", "", 0, 0, 0
+                    if content := choices[0].get('delta', {}).get('content'):
+                        chunks.append(content)
+                        yield content
+
+                answer = "".join(chunks)
+                retry.success()
+                return True, idx, {"role": "assistant", "content": answer}, answer
+
+            except Exception as e:
+                logger.error(e)
+                if chunks:
+                    # 已经 yield 过的内容无法撤回，重新生成会与之拼接成重复的输出
+                    retry.give_up(e)
+                logger.error('发生异常，重试中！')
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
                 continue
 
 
@@ -107,12 +202,15 @@ class OllamaService:
         else:
             self.model = model
 
+        self.endpoint = f"ollama:{self.host}"
         self._client = ollama.Client(self.host)
 
     def __call__(self, messages, idx):
         answer = None
+        retry = _llm_retry(self.endpoint)
         while answer is None:
             try:
+                retry.before_attempt()
                 response = self._client.chat(
                     messages=messages,
                     model=self.model,
@@ -121,12 +219,40 @@ class OllamaService:
                 message = response['message']
                 answer = message['content']
 
-                return True, idx, messages, answer
+                retry.success()
+                return True, idx, message, answer
+
+            except Exception as e:
+                logger.error(e)
+                logger.error('发生异常，重试中！')
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
+                continue
+
+    def stream(self, messages, idx):
+        """
+        流式调用：逐段 yield 生成的文本，生成器的返回值与 __call__ 相同
+        """
+        retry = _llm_retry(self.endpoint)
+        while True:
+            chunks = []
+            try:
+                retry.before_attempt()
+                for chunk in self._client.chat(messages=messages, model=self.model, stream=True):
+                    if content := chunk['message']['content']:
+                        chunks.append(content)
+                        yield content
+
+                answer = "".join(chunks)
+                retry.success()
+                return True, idx, {"role": "assistant", "content": answer}, answer
 
             except Exception as e:
                 logger.error(e)
+                if chunks:
+                    # 已经 yield 过的内容无法撤回，重新生成会与之拼接成重复的输出
+                    retry.give_up(e)
                 logger.error('发生异常，重试中！')
-                time.sleep(1)  # 等待一段时间再重试
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
                 continue
 
 
@@ -134,7 +260,13 @@ class OllamaVisionService:
     def __init__(self,
                  host: str = "http://localhost:11434",
                  model: str = "llama3.2-vision",
+                 keep_alive=None,
                  **kwargs):
+        """
+        keep_alive: 模型在 Ollama 中常驻的时间（如 "30m"），
+            常驻期间服务端可以在相同前缀的请求之间复用 KV cache
+        kwargs: 透传给 Ollama 的 options（temperature、top_p 等）
+        """
         try:
             import ollama
         except ImportError:
@@ -153,34 +285,171 @@ class OllamaVisionService:
         else:
             self.model = model
 
+        self.endpoint = f"ollama:{self.host}"
         self._client = ollama.Client(self.host)
+        self.keep_alive = keep_alive
         self.args = kwargs
 
+    @property
+    def _chat_url(self):
+        host = self.host if "://" in self.host else f"http://{self.host}"
+        return host.rstrip("/") + "/api/chat"
+
+    def _request_fields(self):
+        fields = {"model": self.model, "options": self.args, "stream": False}
+        if self.keep_alive is not None:
+            fields["keep_alive"] = self.keep_alive
+        return fields
+
+    def _chat_raw(self, messages: MessageStore):
+        """直接用 MessageStore 中缓存的 JSON 片段拼接请求体并发送，跳过逐条消息的重新序列化"""
+        r = get_http_client().post(
+            self._chat_url,
+            data=messages.payload(**self._request_fields()),
+            headers={"Content-Type": "application/json"},
+            timeout=SearchConfig().get('llm_timeout')
+        )
+        r.raise_for_status()
+        return r.json()
+
+    def _chat(self, messages):
+        if isinstance(messages, MessageStore):
+            return self._chat_raw(messages)
+        return self._client.chat(
+            messages=raw_image_messages(messages),
+            model=self.model,
+            options=self.args,
+            keep_alive=self.keep_alive,
+        )
+
+    def _chat_stream(self, messages):
+        if isinstance(messages, MessageStore):
+            fields = self._request_fields()
+            fields["stream"] = True
+            for line in get_http_client().iter_lines(
+                'POST',
+                self._chat_url,
+                data=messages.payload(**fields),
+                headers={"Content-Type": "application/json"},
+                timeout=SearchConfig().get('llm_timeout')
+            ):
+                yield json.loads(line)
+            return
+
+        yield from self._client.chat(
+            messages=raw_image_messages(messages),
+            model=self.model,
+            options=self.args,
+            keep_alive=self.keep_alive,
+            stream=True,
+        )
+
+    def stream(self, messages, idx):
+        """
+        流式调用（stream=True）：逐段 yield 生成的文本，生成器的返回值与 __call__ 相同
+        """
+        retry = _llm_retry(self.endpoint)
+        while True:
+            chunks = []
+            try:
+                retry.before_attempt()
+                for chunk in self._chat_stream(messages):
+                    if content := chunk['message']['content']:
+                        chunks.append(content)
+                        yield content
+                    if chunk.get('done'):
+                        _record_usage(chunk)
+
+                answer = "".join(chunks)
+                retry.success()
+                return True, idx, {"role": "assistant", "content": answer}, answer
+
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.format_exc())
+                if chunks:
+                    # 已经 yield 过的内容无法撤回，重新生成会与之拼接成重复的输出
+                    retry.give_up(e)
+                logger.error('发生异常，重试中！')
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
+                continue
+
     def __call__(self, messages, idx):
         answer = None
-        for idx, msg in enumerate(messages):
-            if msg.get("images", None) and isinstance(msg["images"][0], io.BytesIO):
-                file_path = Path("temp.png")
-                with file_path.open("wb") as file:
-                    file.write(msg["images"][0].getvalue())
-                messages[idx].update({"images": [file_path]})
 
+        retry = _llm_retry(self.endpoint)
         while answer is None:
             try:
-                response = self._client.chat(
-                    messages=messages,
-                    model=self.model,
-                    options=self.args,
-                )
+                retry.before_attempt()
+                response = self._chat(messages)
+                _record_usage(response)
                 message = response['message']
                 answer = message['content']
+                retry.success()
                 return True, idx, message, answer
 
             except Exception as e:
                 logger.error(e)
                 logger.error(traceback.format_exc())
                 logger.error('发生异常，重试中！')
-                time.sleep(1)  # 等待一段时间再重试
+                retry.failure(e)  # 指数退避后重试，次数或预算用尽时抛出异常
+                continue
+
+
+class AsyncOllamaVisionService(OllamaVisionService):
+    """OllamaVisionService 的异步版本，基于 ollama.AsyncClient"""
+    def __init__(self,
+                 host: str = "http://localhost:11434",
+                 model: str = "llama3.2-vision",
+                 keep_alive=None,
+                 **kwargs):
+        super().__init__(host, model, keep_alive, **kwargs)
+
+        import httpx
+        import ollama
+        self._client = ollama.AsyncClient(self.host)
+        # MessageStore 的请求体同样异步发送，不占用默认线程池（httpx 是 ollama 的依赖）
+        self._http = httpx.AsyncClient(timeout=SearchConfig().get('llm_timeout'))
+
+    async def _chat_raw_async(self, messages: MessageStore):
+        """_chat_raw 的异步版本"""
+        r = await self._http.post(
+            self._chat_url,
+            content=messages.payload(**self._request_fields()),
+            headers={"Content-Type": "application/json"},
+        )
+        r.raise_for_status()
+        return r.json()
+
+    async def _chat(self, messages):
+        if isinstance(messages, MessageStore):
+            return await self._chat_raw_async(messages)
+        return await self._client.chat(
+            messages=raw_image_messages(messages),
+            model=self.model,
+            options=self.args,
+            keep_alive=self.keep_alive,
+        )
+
+    async def __call__(self, messages, idx):
+        answer = None
+
+        retry = _llm_retry(self.endpoint)
+        while answer is None:
+            try:
+                retry.before_attempt()
+                response = await self._chat(messages)
+                _record_usage(response)
+                message = response['message']
+                answer = message['content']
+                retry.success()
+                return True, idx, message, answer
+
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.format_exc())
+                logger.error('发生异常，重试中！')
+                await retry.failure_async(e)  # 指数退避后重试，次数或预算用尽时抛出异常
                 continue
 
 
@@ -188,5 +457,89 @@ def call_gpt(messages, idx, llm_server) -> Tuple[bool, int, str, str]:
     """
     调用 gpt 的 api 回答问题，包含了违规检查和内容过滤错误。
     但不是官方的 api，其中的一些参数可能要修改成 openai 的官方参数规范
+    根据 LLM_CACHE_MODE 可以录制 / 回放请求结果，见 LLMCache。
+    """
+    _last_usage.set({})
+    with span("llm", model=getattr(llm_server, "model", None)) as llm_span:
+        cache = get_llm_cache()
+        cached, key = cache.lookup(messages, idx, llm_server)
+        if cached is not None:
+            llm_span.set(cached=True)
+            return cached
+
+        result = llm_server(messages, idx)
+        llm_span.set_usage(get_last_usage())
+        cache.store(key, result)
+        return result
+
+
+def stream_gpt(messages, idx, llm_server, parser=None):
+    """
+    call_gpt 的流式版本：逐段 yield 生成的文本，生成器的返回值与 call_gpt 相同。
+    不支持流式的服务会在完成后一次性 yield 全部回答。
+    parser: 可选的 StreamingActionParser，解析到完整的动作行后立即取消生成，
+        回答截断到该动作行为止。
+    """
+    _last_usage.set({})
+    with span("llm", model=getattr(llm_server, "model", None), stream=True) as llm_span:
+        cache = get_llm_cache()
+        cached, key = cache.lookup(messages, idx, llm_server)
+        if cached is not None:
+            llm_span.set(cached=True)
+            yield cached[3]
+            return cached
+
+        if parser is not None and hasattr(llm_server, "stream"):
+            result = yield from _stream_until_action(llm_server.stream(messages, idx), idx, parser)
+            llm_span.set(early_stop=parser.done)
+        elif hasattr(llm_server, "stream"):
+            result = yield from llm_server.stream(messages, idx)
+        else:
+            result = llm_server(messages, idx)
+            yield result[3]
+        llm_span.set_usage(get_last_usage())
+        cache.store(key, result)
+        return result
+
+
+def _stream_until_action(chunks, idx, parser):
+    emitted = 0
+    try:
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration as stop:
+                return stop.value
+
+            if parser.feed(chunk):
+                answer = parser.text
+                if answer[emitted:]:
+                    yield answer[emitted:]
+                logger.debug("Complete action parsed, cancelling generation.")
+                # token 统计只在最后的 done 片段中返回，提前停止后无从得知，明确标记而不是留空
+                _last_usage.set({"early_stopped": True})
+                return True, idx, {"role": "assistant", "content": answer}, answer
+
+            emitted += len(chunk)
+            yield chunk
+    finally:
+        # 关闭生成器会关闭底层的流式响应，服务端随之停止生成
+        chunks.close()
+
+
+async def async_call_gpt(messages, idx, llm_server) -> Tuple[bool, int, str, str]:
+    """
+    call_gpt 的异步版本，llm_server 需要是异步可调用对象（如 AsyncOllamaVisionService）
     """
-    return llm_server(messages, idx)
+    _last_usage.set({})
+    with span("llm", model=getattr(llm_server, "model", None)) as llm_span:
+        cache = get_llm_cache()
+        cached, key = cache.lookup(messages, idx, llm_server)
+        if cached is not None:
+            llm_span.set(cached=True)
+            return cached
+
+        result = await llm_server(messages, idx)
+        llm_span.set_usage(get_last_usage())
+        cache.store(key, result)
+        return result
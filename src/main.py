@@ -1,11 +1,19 @@
+import hashlib
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 import json
 import asyncio
 import argparse
-from agent import QAAgent
-from conversation_manager import ConversationManager
+from functools import partial
+from itertools import islice
+from loguru import logger
+
+from src.agent import QAAgent, AsyncQAAgent
+from src.conversation_manager import ConversationManager
+from src.result_writer import ResultWriter, ResultWriterError, result_files
+from src.search import SearchConfig
+from src.tracing import configure_tracing
 
 
 # 初始化 conversation_manager
@@ -16,61 +24,253 @@ headers = {
 }
 meta_save_path = './docs/'  # 保存地址
 
-    
-# 定义线程锁
-write_lock = threading.Lock()
 
+def iter_jsonl(path):
+    """
+    逐行惰性读取 JSONL，内存占用与文件大小无关。
+    崩溃时写了一半的行（通常是最后一行）无法解析，记录日志后跳过。
+    """
+    with open(path, "r", encoding="utf-8") as fin:
+        for line_no, line in enumerate(fin, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过无法解析的行 {path}:{line_no}")
+
+
+def truncate_partial_line(path):
+    """截掉文件末尾未以换行结束的残缺记录，避免续跑时新记录接在残缺行后面"""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # 从末尾按块向前找最后一个换行
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+        logger.warning(f"截掉 {path} 末尾 {size - end} 字节的残缺记录")
+
+
+def load_done_ids(output_path):
+    """读取已完成的 question_id 集合（包括轮转出去的文件），供续跑时 O(1) 判断"""
+    if os.path.exists(output_path):
+        truncate_partial_line(output_path)
+    return {data['question_id'] for path in result_files(output_path) for data in iter_jsonl(path)}
+
+
+def parse_shard(value):
+    """解析 --shard 参数 "i/N"，返回 (i, N)，要求 0 <= i < N"""
+    try:
+        index, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"--shard 的格式应为 i/N，实际为 {value!r}")
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise argparse.ArgumentTypeError(f"--shard 需满足 0 <= i < N，实际为 {value!r}")
+    return index, num_shards
 
-# 线程安全地写入文件的函数
-def safe_write(file_path, data):
-    with write_lock:
-        with open(file_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+def shard_of(question_id, num_shards):
+    """按 question_id 的稳定哈希（与进程、机器无关）分配分片"""
+    digest = hashlib.md5(str(question_id).encode("utf-8")).hexdigest()
+    return int(digest, 16) % num_shards
+
+
+def output_file_name(shard=None):
+    if shard is None:
+        return "output_from_llm.jsonl"
+    return f"output_from_llm.shard-{shard[0]}-of-{shard[1]}.jsonl"
+
+
+def image_dir_name(shard=None):
+    if shard is None:
+        return "search_images_gpt4v"
+    return os.path.join("search_images_gpt4v", f"shard-{shard[0]}-of-{shard[1]}")
 
 
 # 将 process_item 改写为调用 ConversationManager 来处理每个数据项
-def process_item(item, conversation_manager, meta_save_path, dataset_name):
+def process_item(item, conversation_manager, writer):
     input_question = item['question']
     idx = item['question_id']
     image_url = item['image_url']
 
     # 调用 conversation_manager 的 manage_conversation 方法
-    answer, current_message = conversation_manager.manage_conversation(
+    answer, current_message, thought_info = conversation_manager.manage_conversation(
         input_question=input_question, image_url=image_url, idx=idx
     )
     
     # 将结果保存到 item 中
     item['prediction'] = answer
     # 保存结果
-    output_path = os.path.join(meta_save_path, dataset_name, "output_from_llm.jsonl")
-    safe_write(output_path, item)
+    writer.write(item)
 
 
-def main(test_dataset, dataset_name, meta_save_path):
+def run_concurrently(datas, qa_agent, manager_factory, writer, workers):
     """
-    main 函数，结合 AutoGen 的 ConversationManager 和线程池处理
+    使用有界线程池并发处理数据项。
+    ConversationManager 在实例上保存 conversation_num 与 total_image_quota，
+    因此每个工作线程持有自己的 ConversationManager；单条数据失败不会影响其他数据，
+    结果写入线程失败时取消尚未开始的任务并停止。
     """
+    local = threading.local()
 
-    qa_agent = QAAgent()
+    def worker(item):
+        if not hasattr(local, "conversation_manager"):
+            local.conversation_manager = manager_factory(qa_agent=qa_agent)
+        process_item(item, local.conversation_manager, writer)
 
-    with open(test_dataset, "r", encoding="utf-8") as f:
-        datas = [json.loads(line) for line in f.readlines()]
+    def collect(done):
+        for future in done:
+            item = futures.pop(future)
+            try:
+                future.result()
+            except ResultWriterError:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                logger.exception(f"处理 {item['question_id']} 失败: {e}")
 
-    # 如果文件存在，过滤已处理的项目
-    output_path = os.path.join(meta_save_path, dataset_name, "output_from_llm.jsonl")
-    if os.path.exists(output_path):
-        with open(output_path, "r") as fin:
-            done_id = [json.loads(data)['question_id'] for data in fin.readlines()]
-            datas = [data for data in datas if data['question_id'] not in done_id]
+    # datas 可以是惰性迭代器：只保持有限个进行中的任务，内存占用不随数据集增长
+    datas = iter(datas)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for item in islice(datas, 2 * workers - len(futures)):
+                futures[executor.submit(worker, item)] = item
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            collect(done)
+
+
+async def run_async(datas, qa_agent, manager_factory, writer, concurrency):
+    """
+    使用单个事件循环并发驱动多个对话，由 concurrency 个协程从同一个（可惰性的）迭代器中取数据，
+    从而限制同时进行中的对话数量。
+    每个对话使用独立的 ConversationManager，单条数据失败不会影响其他数据；
+    结果写入线程失败时抛出 ResultWriterError，其余协程随事件循环关闭被取消。
+    """
+    datas = iter(datas)
+
+    async def worker():
+        for item in datas:
+            conversation_manager = manager_factory(qa_agent=qa_agent)
+            try:
+                answer, current_message, thought_info = await conversation_manager.manage_conversation_async(
+                    input_question=item['question'], image_url=item['image_url'], idx=item['question_id']
+                )
+            except Exception as e:
+                logger.exception(f"处理 {item['question_id']} 失败: {e}")
+                continue
+            item['prediction'] = answer
+            writer.write(item)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def main(test_dataset, dataset_name, meta_save_path, workers=1, async_concurrency=0,
+         prefix_cache=False, keep_alive=None, speculative=False, early_stop=False, shard=None,
+         writer_options=None):
+    """
+    main 函数，结合 AutoGen 的 ConversationManager 和线程池处理
+    shard 为 (i, N) 时只处理哈希到第 i 个分片的数据，结果与图片写入该分片独立的文件和目录
+    writer_options 传给 ResultWriter（batch_size、fsync_every、fsync_interval、max_bytes）
+    """
+
+    # 如果文件存在，过滤已处理的项目；输入按行惰性读取
+    output_path = os.path.join(meta_save_path, dataset_name, output_file_name(shard))
+    done_ids = load_done_ids(output_path)
+    logger.info(f"已完成 {len(done_ids)} 条，跳过")
+
+    datas = (data for data in iter_jsonl(test_dataset)
+             if data['question_id'] not in done_ids
+             and (shard is None or shard_of(data['question_id'], shard[1]) == shard[0]))
 
     # 设置 save_path 并创建文件夹
-    save_path = os.path.join(meta_save_path, dataset_name, "search_images_gpt4v")
+    save_path = os.path.join(meta_save_path, dataset_name, image_dir_name(shard))
     os.makedirs(save_path, exist_ok=True)
 
-    conversation_manager = ConversationManager(qa_agent=qa_agent, dataset_name=dataset_name, save_path=save_path)
-    for item in datas:
-        process_item(item, conversation_manager, meta_save_path, dataset_name)
-    
+    manager_factory = partial(ConversationManager,
+                              dataset_name=dataset_name,
+                              save_path=save_path,
+                              prefix_cache=prefix_cache,
+                              speculative=speculative,
+                              early_stop=early_stop)
+
+    with ResultWriter(output_path, **(writer_options or {})) as writer:
+        if async_concurrency > 0:
+            if speculative or early_stop:
+                logger.warning("asyncio 流水线不支持 speculative / early_stop，这两个选项将被忽略")
+            asyncio.run(run_async(datas, AsyncQAAgent(keep_alive=keep_alive), manager_factory,
+                                  writer, async_concurrency))
+            return
+
+        qa_agent = QAAgent(keep_alive=keep_alive)
+        if workers > 1:
+            run_concurrently(datas, qa_agent, manager_factory, writer, workers)
+            return
+
+        conversation_manager = manager_factory(qa_agent=qa_agent)
+        for item in datas:
+            # LLM 与搜索的重试次数有限，失败的数据记录日志后跳过，续跑时会重新处理；
+            # 结果写入线程失败时之后的结果都无法保存，直接停止
+            try:
+                process_item(item, conversation_manager, writer)
+            except ResultWriterError:
+                raise
+            except Exception as e:
+                logger.exception(f"处理 {item['question_id']} 失败: {e}")
+
+
+def merge_shards(test_dataset, dataset_name, meta_save_path, num_shards):
+    """
+    将 N 个分片的结果合并为一个 output_from_llm.jsonl，顺序与输入数据集一致。
+    已存在的 output_from_llm.jsonl（如未分片时的部分结果）也作为来源；缺失的数据会记录日志并跳过。
+    """
+    output_dir = os.path.join(meta_save_path, dataset_name)
+    sources = [output_file_name((index, num_shards)) for index in range(num_shards)]
+    sources.append(output_file_name())
+
+    results = {}
+    for name in sources:
+        paths = result_files(os.path.join(output_dir, name))
+        if not paths and name != output_file_name():
+            logger.warning(f"分片结果不存在: {os.path.join(output_dir, name)}")
+        for path in paths:
+            for data in iter_jsonl(path):
+                results.setdefault(data['question_id'], data)
+
+    output_path = os.path.join(output_dir, output_file_name())
+    tmp_path = output_path + ".tmp"
+    merged, missing = 0, 0
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        for data in iter_jsonl(test_dataset):
+            question_id = data['question_id']
+            if question_id in results:
+                fout.write(json.dumps(results[question_id], ensure_ascii=False) + "\n")
+                merged += 1
+            else:
+                missing += 1
+    # 合并结果已包含旧的轮转文件，删除以免续跑时重复读取
+    # 基础文件不存在时 result_files 不包含它，因此按路径排除而不是去掉最后一个
+    for path in result_files(output_path):
+        if path != output_path:
+            os.remove(path)
+    os.replace(tmp_path, output_path)
+    logger.info(f"合并 {num_shards} 个分片到 {output_path}: {merged} 条，缺失 {missing} 条")
+
 
 if __name__ == "__main__":
     # 设置命令行参数
@@ -78,8 +278,62 @@ if __name__ == "__main__":
     parser.add_argument("--test_dataset", type=str, required=True, help="数据集路径")
     parser.add_argument("--dataset_name", type=str, required=True, help="数据集名称")
     parser.add_argument("--meta_save_path", type=str, required=True, help="存储路径")
+    parser.add_argument("--workers", type=int, default=1, help="并发处理的线程数")
+    parser.add_argument("--async_concurrency", type=int, default=0,
+                        help="大于 0 时使用 asyncio 流水线，并限制同时进行的对话数量")
+    parser.add_argument("--search_cache", type=str, default=None,
+                        help="搜索结果持久化缓存（SQLite）路径，不设置则不缓存")
+    parser.add_argument("--caption_cache", type=str, default=None,
+                        help="输入图片描述的持久化缓存（SQLite）路径，不设置则只在内存中缓存")
+
+    parser.add_argument("--prefix_cache", action="store_true",
+                        help="保持提示前缀稳定以复用 Ollama 的 KV cache，并记录每轮 token 统计")
+    parser.add_argument("--keep_alive", type=str, default=None,
+                        help="模型在 Ollama 中的常驻时间，如 30m")
+    parser.add_argument("--speculative", action="store_true",
+                        help="推测检索：提前在后台生成输入图片描述，并在模型输出检索动作行后立即在后台开始检索")
+    parser.add_argument("--vector_index", action="store_true",
+                        help="本地向量索引：保存检索到的文本与图片描述，相似的子问题直接从索引返回结果")
+    parser.add_argument("--vector_index_path", type=str, default=None,
+                        help="向量索引的持久化路径，不设置则只在内存中保存")
+    parser.add_argument("--early_stop", action="store_true",
+                        help="流式解析模型输出，出现完整的检索动作或最终答案后立即停止生成"
+                             "（提前停止的轮次没有 token 统计）")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="只处理第 i 个分片（共 N 个），格式 i/N；各进程可通过 OLLAMA_HOST 指向不同的 Ollama")
+    parser.add_argument("--merge_shards", type=int, default=0,
+                        help="合并 N 个分片的结果为按输入顺序排列的 output_from_llm.jsonl 后退出")
+    parser.add_argument("--write_batch", type=int, default=64, help="结果写入线程每批最多写入的记录数")
+    parser.add_argument("--fsync_every", type=int, default=0, help="每写入 N 条记录 fsync 一次，0 表示不按条数")
+    parser.add_argument("--fsync_interval", type=float, default=None, help="每隔 T 秒 fsync 一次，不设置则不按时间")
+    parser.add_argument("--rotate_mb", type=float, default=0, help="结果文件超过该大小（MB）后轮转，0 表示不轮转")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="记录各阶段耗时的 span 并追加到该 JSONL 文件，可用 python -m src.tracing 汇总")
+    parser.add_argument("--trace_otlp", type=str, default=None,
+                        help="同时以 OTLP/JSON 格式追加到该文件，可导入 OpenTelemetry 工具")
 
     args = parser.parse_args()
+    if args.async_concurrency > 0 and (args.speculative or args.early_stop):
+        parser.error("--speculative 与 --early_stop 仅支持同步流程，不能与 --async_concurrency 同时使用")
+
+    if args.search_cache:
+        SearchConfig().set('cache_path', args.search_cache)
+    if args.caption_cache:
+        SearchConfig().set('caption_cache_path', args.caption_cache)
+    if args.vector_index:
+        SearchConfig().set('vector_index', True)
+    if args.vector_index_path:
+        SearchConfig().set('vector_index_path', args.vector_index_path)
+    if args.trace or args.trace_otlp:
+        configure_tracing(True, args.trace, args.trace_otlp)
 
-    # 调用 main 函数并传递解析后的参数
-    main(args.test_dataset, args.dataset_name, args.meta_save_path)
+    if args.merge_shards > 0:
+        merge_shards(args.test_dataset, args.dataset_name, args.meta_save_path, args.merge_shards)
+    else:
+        # 调用 main 函数并传递解析后的参数
+        writer_options = dict(batch_size=args.write_batch,
+                              fsync_every=args.fsync_every,
+                              fsync_interval=args.fsync_interval,
+                              max_bytes=int(args.rotate_mb * 1024 * 1024))
+        main(args.test_dataset, args.dataset_name, args.meta_save_path, args.workers, args.async_concurrency,
+             args.prefix_cache, args.keep_alive, args.speculative, args.early_stop, args.shard, writer_options)
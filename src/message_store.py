@@ -0,0 +1,117 @@
+import io
+import os
+import json
+import base64
+import hashlib
+import threading
+import weakref
+from pathlib import Path
+
+
+__all__ = ["MessageStore",
+           "encode_image",
+           "encode_message",
+           "encode_messages",
+           "raw_image_messages"]
+
+
+# 内存图片的 base64 编码缓存：同一个 BytesIO 在整个对话历史中只编码一次
+_encoded_images = weakref.WeakKeyDictionary()
+_encoded_images_lock = threading.Lock()
+
+
+def encode_image(image):
+    """
+    把图片编码为 base64 字符串：内存图片（BytesIO / bytes）与本地图片文件路径（str / Path）都会编码，
+    其余字符串（已是 base64 的图片）原样返回。原始 JSON 请求不会像 ollama.Client 那样替调用方读取文件。
+    """
+    if isinstance(image, io.BytesIO):
+        with _encoded_images_lock:
+            encoded = _encoded_images.get(image)
+        if encoded is None:
+            encoded = base64.b64encode(image.getvalue()).decode()
+            with _encoded_images_lock:
+                _encoded_images[image] = encoded
+        return encoded
+    if isinstance(image, bytes):
+        return base64.b64encode(image).decode()
+    if isinstance(image, (str, Path)) and os.path.isfile(image):
+        return base64.b64encode(Path(image).read_bytes()).decode()
+    return image
+
+
+def encode_message(msg):
+    """返回一份图片已编码为 base64 的消息副本，不修改原消息"""
+    if msg.get("images", None):
+        msg = dict(msg)
+        msg["images"] = [encode_image(image) for image in msg["images"]]
+    return msg
+
+
+def encode_messages(messages):
+    """
+    返回一份图片已编码为 base64 的消息副本，直接在内存中传给 Ollama，
+    不写临时文件，也不修改调用方的消息列表。
+    """
+    if isinstance(messages, MessageStore):
+        return messages.encoded()
+    return [encode_message(msg) for msg in messages]
+
+
+def raw_image_messages(messages):
+    """
+    返回一份内存图片替换为原始字节的消息副本，供 ollama.Client 使用。
+    ollama.Client 会自行对 bytes 做 base64 编码，而字符串图片会先被当作文件路径检查，
+    较长的 base64 字符串在 ollama 0.4.1 中会因文件名过长抛出 OSError。
+    """
+    result = []
+    for msg in messages:
+        if msg.get("images", None):
+            msg = dict(msg)
+            msg["images"] = [image.getvalue() if isinstance(image, io.BytesIO) else image
+                             for image in msg["images"]]
+        result.append(msg)
+    return result
+
+
+class MessageStore(list):
+    """
+    只追加的对话消息存储。
+    每条消息在追加时编码一次（图片转 base64、序列化为 JSON 片段）并缓存，
+    之后每轮请求直接用缓存片段拼接请求体，序列化开销只与新增消息有关，与历史长度无关。
+    消息追加后不应再修改。
+    """
+    def __init__(self, messages=()):
+        super().__init__()
+        self._encoded = []
+        self._fragments = []
+        self._digests = []
+        self.extend(messages)
+
+    def append(self, msg):
+        encoded = {key: value for key, value in dict(encode_message(msg)).items() if value is not None}
+        fragment = json.dumps(encoded, ensure_ascii=False).encode("utf-8")
+        super().append(msg)
+        self._encoded.append(encoded)
+        self._fragments.append(fragment)
+        self._digests.append(hashlib.sha256(fragment).hexdigest())
+
+    def extend(self, messages):
+        for msg in messages:
+            self.append(msg)
+
+    def encoded(self):
+        """已编码的消息列表（图片为 base64）"""
+        return list(self._encoded)
+
+    def digests(self):
+        """每条消息编码后的 sha256，可用于构造缓存键"""
+        return list(self._digests)
+
+    def payload(self, **fields) -> bytes:
+        """用缓存的 JSON 片段拼接请求体：{**fields, "messages": [...]}"""
+        head = json.dumps(fields, ensure_ascii=False)[:-1]
+        separator = ", " if fields else ""
+        return ((head + separator + '"messages": [').encode("utf-8")
+                + b", ".join(self._fragments)
+                + b"]}")
@@ -43,6 +43,12 @@ Extra notes:
 Input Question:{}
 '''
 
+# sys_prompt_1 拆分为与问题无关的固定前缀（作为 system 消息）和问题部分，
+# 所有对话共享完全相同的前缀，Ollama 可以复用该前缀的 KV cache
+sys_prompt_1_prefix = sys_prompt_1.split("Input Question:{}")[0]
+sys_prompt_1_question = '''Input Question:{}
+'''
+
 sys_prompt_1_wexample_1 = '''You are a multimodal question answering assistant. Decompose the original question into sub-questions and solve them step by step. You can use "Final Answer" to output a sentence in the answer, use "Search" to state what additional context or information is needed to provide a precise answer to the "Sub-Question". In the "Search" step, You can use "Image Retrieval with Input Image" to seek images similar to the original ones and determine their titles, "Text Retrieval" with a specific query to fetch pertinent documents and summarize their content, "Image Retrieval with Text Query" to fetch images related to the entered keywords.
 Use the following format strictly:
 <Thought>
@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import glob
+import time
+import queue
+import threading
+from typing import List, Optional
+
+from loguru import logger
+
+
+__all__ = ["ResultWriter",
+           "ResultWriterError",
+           "result_files"]
+
+
+_STOP = object()
+
+
+class ResultWriterError(RuntimeError):
+    """写入线程已失败，之后的结果都无法保存，调用方应停止处理而不是当作单条数据失败跳过"""
+
+
+def result_files(path: str) -> List[str]:
+    """
+    返回 path 及其轮转文件（path.1, path.2, ...），按写入顺序排列，只包含存在的文件。
+    续跑与合并分片时都应读取全部文件。
+    """
+    pattern = re.compile(re.escape(os.path.basename(path)) + r"\.(\d+)$")
+    rotated = []
+    for candidate in glob.glob(glob.escape(path) + ".*"):
+        match = pattern.match(os.path.basename(candidate))
+        if match:
+            rotated.append((int(match.group(1)), candidate))
+    files = [candidate for _, candidate in sorted(rotated)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+class ResultWriter:
+    """
+    结果写入线程：调用方只把记录放进队列，后台线程批量取出后一次写入，
+    避免每条记录都加全局锁、打开、追加、关闭文件。
+
+    fsync 策略：每写入 fsync_every 条记录或距上次 fsync 超过 fsync_interval 秒时 fsync 一次，
+    两者都不设置时只 flush 到操作系统。
+    max_bytes > 0 时按大小轮转：当前文件超过 max_bytes 后重命名为 path.N（N 递增），再写新的 path。
+    """
+    def __init__(self,
+                 path: str,
+                 batch_size: int = 64,
+                 fsync_every: int = 0,
+                 fsync_interval: Optional[float] = None,
+                 max_bytes: int = 0):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+
+        self._queue = queue.Queue()
+        self._error = None
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, item: dict) -> None:
+        """把一条记录放入写入队列，不阻塞调用方"""
+        if self._error is not None:
+            raise ResultWriterError(f"结果写入线程已失败: {self._error}") from self._error
+        self._queue.put(json.dumps(item, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        """写完队列中剩余的记录后停止写入线程并关闭文件"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+        if self._error is not None:
+            raise ResultWriterError(f"结果写入线程已失败: {self._error}") from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _next_batch(self):
+        """阻塞等待第一条记录（最多等到下一次定时 fsync），再非阻塞地取满一批"""
+        timeout = None
+        if self.fsync_interval and self._unsynced:
+            timeout = max(0.0, self.fsync_interval - (time.monotonic() - self._last_sync))
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                stop = bool(batch) and batch[-1] is _STOP
+                lines = batch[:-1] if stop else batch
+                if lines:
+                    self._file.write("".join(lines))
+                    self._file.flush()
+                    self._unsynced += len(lines)
+                self._maybe_sync(force=stop)
+                if lines and self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+                    self._rotate()
+                if stop:
+                    return
+        except Exception as e:
+            logger.exception(f"写入 {self.path} 失败: {e}")
+            self._error = e
+
+    def _maybe_sync(self, force=False):
+        if not self._unsynced:
+            return
+        due = (force
+               or (self.fsync_every and self._unsynced >= self.fsync_every)
+               or (self.fsync_interval and time.monotonic() - self._last_sync >= self.fsync_interval))
+        if due and (self.fsync_every or self.fsync_interval):
+            os.fsync(self._file.fileno())
+        if due:
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self._maybe_sync(force=True)
+        self._file.close()
+        existing = result_files(self.path)[:-1]
+        index = int(existing[-1].rsplit(".", 1)[1]) + 1 if existing else 1
+        os.replace(self.path, f"{self.path}.{index}")
+        self._file = open(self.path, "a", encoding="utf-8")
+        logger.info(f"结果文件轮转为 {self.path}.{index}")
@@ -1,7 +1,12 @@
 from .search_strategy import SearchStrategy, TextSearchStrategy, ImageSearchStrategy, ImageProcessor
 from .search_factory import SearchFactory
 from .search_config import SearchConfig
-from .search_service import SearchService
+from .search_cache import SearchCache
+from .http_client import HttpClient, get_http_client
+from .resilience import Retry, CircuitBreaker, RetryBudget, CircuitOpenError
+from .scheduler import SearchScheduler, get_search_scheduler, search_priority, INTERACTIVE, BATCH
+from .vector_index import VectorIndex, OllamaEmbedder, get_vector_index
+from .search_service import SearchService, AsyncSearchService
 
 
 __all__ = [
@@ -11,5 +16,21 @@ __all__ = [
     'ImageProcessor',
     'SearchFactory',
     'SearchConfig',
-    'SearchService'
+    'SearchCache',
+    'HttpClient',
+    'get_http_client',
+    'Retry',
+    'CircuitBreaker',
+    'RetryBudget',
+    'CircuitOpenError',
+    'SearchScheduler',
+    'get_search_scheduler',
+    'search_priority',
+    'INTERACTIVE',
+    'BATCH',
+    'VectorIndex',
+    'OllamaEmbedder',
+    'get_vector_index',
+    'SearchService',
+    'AsyncSearchService'
 ]
@@ -0,0 +1,123 @@
+"""
+Shared pooled HTTP client for all outbound I/O
+"""
+from threading import Lock
+from typing import Any, Iterator, Optional
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from .search_config import SearchConfig
+
+
+class HttpClient:
+    """Thread-safe HTTP client with keep-alive connection pooling.
+
+    Uses a requests.Session by default. When HTTP/2 is requested and httpx
+    (with the h2 extra) is installed, an httpx.Client is used instead; both
+    expose the same get/post/response surface used across the project.
+    """
+    def __init__(self,
+                 pool_connections: int = 16,
+                 pool_maxsize: int = 32,
+                 timeout: Optional[float] = 30,
+                 http2: bool = False):
+        self.timeout = timeout
+        self.http2 = False
+
+        if http2:
+            try:
+                import httpx
+                self._session = httpx.Client(
+                    http2=True,
+                    timeout=timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                        max_keepalive_connections=pool_maxsize)
+                )
+                self.http2 = True
+                return
+            except ImportError:
+                logger.warning("httpx[http2] is not installed, falling back to HTTP/1.1. "
+                               "Install it with `pip install httpx[http2]`")
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> Any:
+        """
+        Send a request through the shared connection pool
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Extra arguments for the underlying client (json, headers, timeout, ...)
+
+        Returns:
+            The response object
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> Any:
+        """Send a GET request"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Any:
+        """Send a POST request"""
+        return self.request('POST', url, **kwargs)
+
+    def iter_lines(self, method: str, url: str, **kwargs) -> Iterator[str]:
+        """
+        Send a streaming request and yield the non-empty lines of the response body
+
+        Closing the generator early closes the underlying response, which
+        also lets the server stop generating.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Extra arguments for the underlying client (data, headers, timeout, ...)
+
+        Yields:
+            Response lines decoded as text
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if self.http2:
+            with self._session.stream(method, url, **kwargs) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line:
+                        yield line
+            return
+
+        with self._session.request(method, url, stream=True, **kwargs) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        self._session.close()
+
+
+_http_client = None
+_http_client_lock = Lock()
+
+
+def get_http_client() -> HttpClient:
+    """Return the process-wide HttpClient, built from SearchConfig on first use"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                config = SearchConfig()
+                _http_client = HttpClient(pool_connections=config.get('http_pool_connections', 16),
+                                          pool_maxsize=config.get('http_pool_maxsize', 32),
+                                          timeout=config.get('timeout'),
+                                          http2=config.get('http2', False))
+    return _http_client
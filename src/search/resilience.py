@@ -0,0 +1,264 @@
+"""
+Shared retry policy: exponential backoff with full jitter, Retry-After handling,
+per-endpoint circuit breakers and retry budgets
+"""
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from loguru import logger
+
+from .search_config import SearchConfig
+
+
+# Retrying these cannot succeed, the request itself is at fault
+_NON_RETRYABLE_STATUS = {400, 401, 403, 404, 405, 413, 422}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while an endpoint's circuit is open"""
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Circuit for {endpoint} is open, retry in {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        # ollama.ResponseError carries the status code itself
+        status = getattr(exc, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    Extract the server-requested delay from an exception
+
+    Args:
+        exc: Exception raised by a request
+
+    Returns:
+        The Retry-After header in seconds (numeric or HTTP date), 0 for a rate
+        limit without the header (429/503 or a DDGS RatelimitException), or None
+        when the error is not a rate limit
+    """
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if _status_code(exc) in (429, 503) or type(exc).__name__ == 'RatelimitException':
+        return 0.0
+    return None
+
+
+class CircuitBreaker:
+    """Circuit breaker for one endpoint.
+
+    Opens after failure_threshold consecutive failures and fails requests fast
+    for reset_timeout seconds. It then lets a single probe through (half-open):
+    success closes the circuit, failure opens it again. A probe that never
+    reports back (e.g. an abandoned stream) is replaced after reset_timeout.
+    """
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """'closed', 'open' or 'half-open'"""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def before_request(self) -> None:
+        """Raise CircuitOpenError unless a request may be sent now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(self.endpoint, remaining)
+            now = time.monotonic()
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self.endpoint, min(1.0, self.reset_timeout))
+            self._probe_started = now
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.endpoint} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probe_started is not None or (self._opened_at is None
+                                                   and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit for {self.endpoint} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._probe_started = None
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of the request rate.
+
+    Every request deposits `ratio` tokens, every retry withdraws one, and
+    `min_per_second` tokens are added per second so that low-traffic callers
+    can still retry. During an outage, retries therefore add at most about
+    `ratio` times the normal load instead of multiplying it.
+    """
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens,
+                           self._tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take a token for one retry; False when the budget is exhausted"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the circuit breaker shared by all callers of an endpoint"""
+    with _registry_lock:
+        if endpoint not in _breakers:
+            config = SearchConfig()
+            _breakers[endpoint] = CircuitBreaker(endpoint,
+                                                 config.get('breaker_failure_threshold', 5),
+                                                 config.get('breaker_reset_timeout', 30.0))
+        return _breakers[endpoint]
+
+
+def get_retry_budget(endpoint: str) -> RetryBudget:
+    """Return the retry budget shared by all callers of an endpoint"""
+    with _registry_lock:
+        if endpoint not in _budgets:
+            config = SearchConfig()
+            _budgets[endpoint] = RetryBudget(config.get('retry_budget_ratio', 0.2),
+                                             config.get('retry_budget_min_per_second', 1.0))
+        return _budgets[endpoint]
+
+
+class Retry:
+    """Retry state of one logical request; works in loops, generators and coroutines.
+
+        retry = Retry('ollama:http://localhost:11434', max_attempts=8)
+        while True:
+            try:
+                retry.before_attempt()
+                result = send()
+                retry.success()
+                return result
+            except Exception as e:
+                retry.failure(e)    # or `await retry.failure_async(e)`
+
+    failure() sleeps for an exponential backoff with full jitter, i.e. uniformly
+    in [0, min(max_delay, base_delay * 2^n)], and at least as long as a
+    Retry-After sent by the server. It re-raises the error once attempts run
+    out, the endpoint's retry budget is exhausted or the error is not retryable.
+    """
+    def __init__(self,
+                 endpoint: str,
+                 max_attempts: Optional[int] = None,
+                 base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None):
+        config = SearchConfig()
+        self.endpoint = endpoint
+        self.max_attempts = max_attempts or config.get('max_retries', 5)
+        self.base_delay = config.get('retry_base_delay', 1.0) if base_delay is None else base_delay
+        self.max_delay = config.get('retry_max_delay', 60.0) if max_delay is None else max_delay
+        self.attempt = 0
+        self._breaker = get_circuit_breaker(endpoint)
+        self._budget = get_retry_budget(endpoint)
+
+    def before_attempt(self) -> None:
+        """Call before every attempt; raises CircuitOpenError while the circuit is open"""
+        self.attempt += 1
+        if self.attempt == 1:
+            self._budget.record_request()
+        self._breaker.before_request()
+
+    def success(self) -> None:
+        self._breaker.record_success()
+
+    def _delay(self, exc: Exception) -> float:
+        """Record a failure and return the delay before the next attempt, or re-raise exc"""
+        wait = 0.0
+        if isinstance(exc, CircuitOpenError):
+            wait = exc.retry_after
+        elif _status_code(exc) in _NON_RETRYABLE_STATUS:
+            # The endpoint answered, so it is healthy
+            self._breaker.record_success()
+            raise exc
+        else:
+            self._breaker.record_failure()
+            wait = retry_after_seconds(exc) or 0.0
+
+        if self.attempt >= self.max_attempts:
+            logger.error(f"{self.endpoint}: all {self.attempt} attempts failed")
+            raise exc
+        if not isinstance(exc, CircuitOpenError) and not self._budget.try_spend():
+            logger.error(f"{self.endpoint}: retry budget exhausted, giving up")
+            raise exc
+
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (self.attempt - 1)))
+        delay = max(backoff, wait)
+        logger.warning(f"{self.endpoint}: attempt {self.attempt} failed ({exc}), retrying in {delay:.2f}s")
+        return delay
+
+    def give_up(self, exc: Exception) -> None:
+        """Record a failed attempt that must not be retried (e.g. a stream that already produced output) and re-raise exc"""
+        self._breaker.record_failure()
+        raise exc
+
+    def failure(self, exc: Exception) -> None:
+        """Sleep before the next attempt, or re-raise exc when no retry is allowed"""
+        time.sleep(self._delay(exc))
+
+    async def failure_async(self, exc: Exception) -> None:
+        """Asyncio counterpart of failure()"""
+        await asyncio.sleep(self._delay(exc))
@@ -0,0 +1,115 @@
+"""
+Process-wide request scheduler for DuckDuckGo searches
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+from .search_config import SearchConfig
+
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+
+_priority: ContextVar[int] = ContextVar('search_priority', default=BATCH)
+
+
+@contextmanager
+def search_priority(priority: int):
+    """
+    Run the enclosed searches with the given priority
+
+        with search_priority(INTERACTIVE):
+            for event in manager.iter_conversation(...):
+                ...
+
+    The priority follows the current context, so it also applies to work
+    offloaded with asyncio.to_thread or contextvars.copy_context().run.
+
+    Args:
+        priority: INTERACTIVE or BATCH
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class SearchScheduler:
+    """Token-bucket scheduler in front of the search provider.
+
+    Every attempt to call the provider takes a token from the bucket of its
+    search type, refilled at the configured QPS, so parallel conversations
+    stay just below the provider's limit instead of bursting into rate limits
+    and backing off. The limits are read from SearchConfig on every request
+    ('search_qps' maps a search type to requests per second, 'search_burst'
+    sets the bucket size), so they can be changed at runtime.
+
+    Waiting callers are served by priority (interactive before batch), then in
+    arrival order.
+    """
+    def __init__(self):
+        self.config = SearchConfig()
+        self._tokens: Dict[str, float] = {}
+        self._updated: Dict[str, float] = {}
+        self._waiters: Dict[str, list] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self, search_type: str, rate: float) -> float:
+        burst = max(1.0, self.config.get('search_burst', 1.0))
+        now = time.monotonic()
+        tokens = self._tokens.get(search_type, burst)
+        tokens = min(burst, tokens + (now - self._updated.get(search_type, now)) * rate)
+        self._tokens[search_type] = tokens
+        self._updated[search_type] = now
+        return tokens
+
+    def acquire(self, search_type: str) -> None:
+        """
+        Block until a request of this search type may be sent
+
+        Args:
+            search_type: Search type whose QPS limit applies ('text' or 'image')
+        """
+        rate = (self.config.get('search_qps') or {}).get(search_type)
+        if not rate:
+            return
+        entry = (_priority.get(), next(self._sequence))
+        with self._condition:
+            waiters = self._waiters.setdefault(search_type, [])
+            heapq.heappush(waiters, entry)
+            try:
+                while True:
+                    tokens = self._refill(search_type, rate)
+                    if waiters[0] == entry:
+                        if tokens >= 1:
+                            self._tokens[search_type] = tokens - 1
+                            return
+                        self._condition.wait((1 - tokens) / rate)
+                    else:
+                        self._condition.wait()
+            finally:
+                waiters.remove(entry)
+                heapq.heapify(waiters)
+                self._condition.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_search_scheduler() -> SearchScheduler:
+    """Return the process-wide SearchScheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = SearchScheduler()
+    return _scheduler
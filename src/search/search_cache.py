@@ -0,0 +1,125 @@
+"""
+Persistent on-disk cache for search results
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from loguru import logger
+
+
+class SearchCache:
+    """Content-addressed SQLite cache with TTL and size-based LRU eviction.
+
+    Every thread gets its own connection; WAL journaling and a busy timeout
+    let several processes share the same cache file.
+    """
+    _EVICT_EVERY = 100
+
+    def __init__(self,
+                 path: str,
+                 ttl: Optional[float] = 7 * 24 * 3600,
+                 max_entries: int = 100000,
+                 table: str = 'search_results'):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_lru ON {self.table} (last_access)")
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable content hash from the given key parts"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached value
+
+        Args:
+            key: Cache key built with make_key
+
+        Returns:
+            The cached value, or None on a miss or an expired entry
+        """
+        try:
+            conn = self._connection()
+            row = conn.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"Search cache read failed: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a JSON-serializable value
+
+        Args:
+            key: Cache key built with make_key
+            value: Value to store
+        """
+        try:
+            now = time.time()
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Search cache write failed: {e}")
+            return
+
+        with self._writes_lock:
+            self._writes += 1
+            should_evict = self._writes % self._EVICT_EVERY == 0
+        if should_evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        try:
+            conn = self._connection()
+            if self.ttl is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Search cache eviction failed: {e}")
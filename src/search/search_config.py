@@ -23,10 +23,55 @@ class SearchConfig:
                 'max_retries': 5,
                 'max_results': 5,
                 'safesearch': 'Off',
-                'timeout': 30
+                'timeout': 30,
+                'llm_timeout': 300,
+                # Retrieved images are only downscaled above this size (llama3.2-vision uses 1120)
+                'max_image_resolution': 1120,
+                'save_search_images': True,
+                # Top-k image retrieval: candidates requested, images kept, per-image download timeout
+                'image_max_results': 10,
+                'image_top_k': 5,
+                'image_download_timeout': 10,
+                # Shared HTTP connection pool
+                'http_pool_connections': 16,
+                'http_pool_maxsize': 32,
+                'http2': False,
+                # Persistent search cache, disabled when cache_path is None
+                'cache_path': None,
+                'cache_ttl': 7 * 24 * 3600,
+                'cache_max_entries': 100000,
+                # Input image captions: in-memory LRU size and optional SQLite path
+                'caption_cache_size': 1024,
+                'caption_cache_path': None,
+                # Retries (see resilience.Retry): backoff with full jitter, capped attempts
+                'retry_base_delay': 1.0,
+                'retry_max_delay': 60.0,
+                'llm_max_retries': 8,
+                # Per-endpoint circuit breakers and retry budgets
+                'breaker_failure_threshold': 5,
+                'breaker_reset_timeout': 30.0,
+                'retry_budget_ratio': 0.2,
+                'retry_budget_min_per_second': 1.0,
+                # Requests per second sent to DuckDuckGo per search type, and the allowed burst
+                'search_qps': {'text': 1.0, 'image': 1.0},
+                'search_burst': 3,
+                # Local embedding index of retrieved documents, consulted before text searches
+                'vector_index': False,
+                'vector_index_backend': 'numpy',
+                'vector_index_path': None,
+                'vector_index_threshold': 0.8,
+                'vector_index_min_hits': 3,
+                'embedding_model': 'nomic-embed-text'
             }
+            # Bumped on every change so that cached objects built from the config can be rebuilt
+            self._version = 0
             self._initialized = True
     
+    @property
+    def version(self) -> int:
+        """Number of changes made to the configuration so far"""
+        return self._version
+    
     def get(self, key: str, default: Any = None) -> Any:
         """Get configuration value"""
         return self._config.get(key, default)
@@ -35,8 +80,10 @@ class SearchConfig:
         """Set configuration value"""
         with self._lock:
             self._config[key] = value
+            self._version += 1
     
     def update(self, config_dict: Dict[str, Any]) -> None:
         """Update multiple configuration values"""
         with self._lock:
             self._config.update(config_dict)
+            self._version += 1
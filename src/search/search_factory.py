@@ -1,21 +1,33 @@
 """
 Factory pattern for Agent Creation
 """
-from typing import Dict, Type
+import atexit
+from threading import Lock
+from typing import Any, Dict, Tuple, Type
+from .search_config import SearchConfig
 from .search_strategy import SearchStrategy, TextSearchStrategy, ImageSearchStrategy
 
 
 class SearchFactory:
-    """Factory for creating search strategy instances"""
+    """Factory for creating search strategy instances
+
+    Strategies are thread-safe and keep long-lived DDGS clients, so instances
+    are cached per (type, arguments) and shared by all callers. The cache is
+    dropped, and the clients of the dropped strategies closed, whenever
+    SearchConfig changes, on clear() and at interpreter exit.
+    """
     _strategies: Dict[str, Type[SearchStrategy]] = {
         'text': TextSearchStrategy,
         'image': ImageSearchStrategy
     }
+    _instances: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], SearchStrategy] = {}
+    _config_version = None
+    _lock = Lock()
 
     @classmethod
     def get_strategy(cls, strategy_type: str, **kwargs) -> SearchStrategy:
         """
-        Create and return a search strategy instance
+        Return a shared search strategy instance
         
         Args:
             strategy_type: Type of search strategy ('text' or 'image')
@@ -30,5 +42,30 @@ class SearchFactory:
         strategy_class = cls._strategies.get(strategy_type)
         if not strategy_class:
             raise ValueError(f"Unsupported search strategy: {strategy_type}")
-        
-        return strategy_class(**kwargs)
+
+        key = (strategy_type, tuple(sorted(kwargs.items())))
+        version = SearchConfig().version
+        stale = []
+        with cls._lock:
+            if cls._config_version != version:
+                stale = list(cls._instances.values())
+                cls._instances.clear()
+                cls._config_version = version
+            strategy = cls._instances.get(key)
+            if strategy is None:
+                strategy = cls._instances[key] = strategy_class(**kwargs)
+        for dropped in stale:
+            dropped.close()
+        return strategy
+
+    @classmethod
+    def clear(cls) -> None:
+        """Drop all cached strategies and close their clients"""
+        with cls._lock:
+            stale = list(cls._instances.values())
+            cls._instances.clear()
+        for strategy in stale:
+            strategy.close()
+
+
+atexit.register(SearchFactory.clear)
@@ -1,15 +1,80 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 from typing import List, Dict, Any, Tuple, Optional
+from loguru import logger
 from .search_factory import SearchFactory
 from .search_config import SearchConfig
 from .search_strategy import ImageProcessor
+from .search_cache import SearchCache
+from .vector_index import VectorIndex, get_vector_index
+from ..singleflight import get_singleflight
+from ..tracing import span
+
+IMAGE_SEARCH_TYPES = ('image', 'img_search_img', 'text_search_img')
 
 
 class SearchService:
     """Main service class for handling searches.
     """
+    _downloader = ThreadPoolExecutor(max_workers=16, thread_name_prefix='image-download')
+    _indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vector-index')
+
     def __init__(self):
         self.config = SearchConfig()
         self.image_processor = ImageProcessor()
+        self.vector_index = get_vector_index()
+        self.cache = None
+        if cache_path := self.config.get('cache_path'):
+            self.cache = SearchCache(cache_path,
+                                     ttl=self.config.get('cache_ttl'),
+                                     max_entries=self.config.get('cache_max_entries'))
+
+    def _search(self, strategy_type: str, query: str) -> Any:
+        """
+        Run a search strategy, serving repeated queries from the persistent cache
+
+        Concurrent identical queries are coalesced into a single provider call
+        (see SingleFlight), which is rate limited by the SearchScheduler.
+
+        Args:
+            strategy_type: Type of search strategy ('text' or 'image')
+            query: Search query text
+
+        Returns:
+            Raw search results of the strategy
+        """
+        max_results = self.config.get('max_results')
+        if strategy_type == 'image':
+            # Fetch spare candidates so that dead links can be skipped
+            max_results = self.config.get('image_max_results', max_results)
+        safesearch = self.config.get('safesearch')
+        normalized_query = ' '.join(query.lower().split())
+        key = None
+        if self.cache is not None:
+            key = SearchCache.make_key(strategy_type, normalized_query, max_results, safesearch)
+            with span("search_cache", strategy=strategy_type) as cache_span:
+                cached = self.cache.get(key)
+                cache_span.set(hit=cached is not None)
+            if cached is not None:
+                return cached
+
+        strategy = SearchFactory.get_strategy(
+            strategy_type,
+            max_retries=self.config.get('max_retries'),
+            max_results=max_results,
+            safesearch=safesearch
+        )
+
+        def search():
+            with span("ddgs", strategy=strategy_type):
+                result = strategy.search(query)
+            if key is not None:
+                self.cache.set(key, result)
+            return result
+
+        return get_singleflight('ddgs').do((strategy_type, normalized_query, max_results, safesearch), search)
 
     def text_search(self, query: str) -> List[Dict[str, str]]:
         """
@@ -21,16 +86,15 @@ class SearchService:
         Returns:
             List of search results
         """
-        strategy = SearchFactory.get_strategy(
-            'text',
-            max_retries=self.config.get('max_retries'),
-            max_results=self.config.get('max_results')
-        )
-        return strategy.search(query)
+        return self._search('text', query)
 
-    def image_search(self, query: str, save_path: str, idx: int, conversation_num: int) -> Tuple[str, str]:
+    def image_search(self,
+                     query: str,
+                     save_path: str,
+                     idx: int,
+                     conversation_num: int) -> Tuple[str, Optional[str], BytesIO]:
         """
-        Perform image-based search and save the result
+        Perform image-based search and download the best result that loads
         
         Args:
             query: Search query text
@@ -39,15 +103,79 @@ class SearchService:
             conversation_num: Conversation number
             
         Returns:
-            Tuple of (image_url, save_path)
+            Tuple of (image_url, saved image path or None, in-memory image bytes)
+
+        Raises:
+            ValueError: If none of the results could be downloaded
         """
-        strategy = SearchFactory.get_strategy(
-            'image',
-            max_retries=self.config.get('max_retries'),
-            max_results=self.config.get('max_results')
-        )
-        result = strategy.search(query)
-        return self.image_processor.save_search_result(result, save_path, idx, conversation_num)
+        downloaded = self._download_images(self._image_results(query), save_path, idx, conversation_num, 1)
+        if not downloaded:
+            raise ValueError(f"No image result could be downloaded for {query!r}")
+        return downloaded[0][0]
+
+    def _image_results(self, query: str) -> List[Dict[str, Any]]:
+        results = self._search('image', query)
+        # Entries cached before top-k retrieval hold a single result
+        return [results] if isinstance(results, dict) else list(results)
+
+    def _download_image(self, result: Dict[str, Any], position: int) -> Tuple[str, bytes, str]:
+        # Every download has its own deadline through the request timeout
+        with span("image_download", source="search", position=position):
+            return self.image_processor.download_search_result(result,
+                                                               max_resolution=self.config.get('max_image_resolution'),
+                                                               timeout=self.config.get('image_download_timeout'))
+
+    def _download_images(self,
+                         results: List[Dict[str, Any]],
+                         save_path: str,
+                         idx: int,
+                         conversation_num: int,
+                         k: int) -> List[Tuple[Tuple[str, Optional[str], BytesIO], str]]:
+        """
+        Download image results concurrently and keep the first k that decode
+
+        Dead links, timeouts and undecodable images are skipped. Once k images
+        have loaded, the downloads still pending are abandoned and their
+        results discarded; only the images kept are saved.
+
+        Args:
+            results: Image search results in rank order
+            save_path: Path to save the images
+            idx: Image index
+            conversation_num: Conversation number
+            k: Number of images to keep
+
+        Returns:
+            List of (downloaded image, result title) pairs in rank order
+        """
+        futures = {
+            self._downloader.submit(contextvars.copy_context().run, self._download_image, result, position): position
+            for position, result in enumerate(results)
+        }
+        downloads = {}
+        try:
+            for future in as_completed(futures):
+                position = futures[future]
+                try:
+                    downloads[position] = future.result()
+                except Exception as e:
+                    logger.warning(f"Skipping image result {results[position].get('image')}: {e}")
+                    continue
+                if len(downloads) >= k:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+
+        images = []
+        for position in sorted(downloads):
+            image_url, data, extension = downloads[position]
+            image_path = None
+            if self.config.get('save_search_images'):
+                image_path = self.image_processor.save_image(data, extension, save_path, idx,
+                                                             conversation_num, position)
+            images.append(((image_url, image_path, BytesIO(data)), results[position].get('title', '')))
+        return images
 
     def fine_search(self,
                    query: str,
@@ -55,13 +183,14 @@ class SearchService:
                    save_path: str,
                    dataset_name: str,
                    idx: int,
-                   conversation_num: int) -> Tuple[List[Tuple[str, str]], List[str]]:
+                   conversation_num: int) -> Tuple[List[Tuple[str, Optional[str], BytesIO]], List[str]]:
         """
         Perform a detailed search based on type
         
         Args:
             query: Search query
-            search_type: Type of search ('text' or 'image')
+            search_type: Type of search ('text', 'image' or one of the tool names
+                'text_search_text', 'img_search_img', 'text_search_img')
             save_path: Path to save results
             dataset_name: Name of dataset
             idx: Search index
@@ -70,14 +199,123 @@ class SearchService:
         Returns:
             Tuple of (list of image results, list of text results)
         """
+        # Identical searches already in flight (e.g. the same sub-question asked by
+        # several dataset items) are shared; each caller gets its own image buffers.
+        # Saved images are named after idx and conversation_num, so image searches
+        # are only shared within one turn (the provider call itself is still
+        # coalesced across questions in _search)
+        key = (search_type, ' '.join(query.lower().split()), save_path, dataset_name)
+        if search_type in IMAGE_SEARCH_TYPES:
+            key += (idx, conversation_num)
+        search_images, search_texts = get_singleflight('fine_search').do(
+            key, lambda: self._fine_search(query, search_type, save_path, idx, conversation_num)
+        )
+        return ([(image_url, image_path, BytesIO(image.getvalue())) for image_url, image_path, image in search_images],
+                list(search_texts))
+
+    def _fine_search(self,
+                     query: str,
+                     search_type: str,
+                     save_path: str,
+                     idx: int,
+                     conversation_num: int) -> Tuple[List[Tuple[str, Optional[str], BytesIO]], List[str]]:
         search_images = []
         search_texts = []
 
-        if search_type == 'image':
-            image_url, save_path = self.image_search(query, save_path, idx, conversation_num)
-            search_images.append((image_url, save_path))
-        else:
-            results = self.text_search(query)
-            search_texts.extend([result.get('body', '') for result in results])
+        with span("search", search_type=search_type, conversation_num=str(conversation_num)):
+            if search_type in IMAGE_SEARCH_TYPES:
+                results = self._image_results(query)
+                downloaded = self._download_images(results, save_path, idx, conversation_num,
+                                                   self.config.get('image_top_k', 5))
+                # The image title serves as its description in the follow-up prompt
+                for image, title in downloaded:
+                    search_images.append(image)
+                    search_texts.append(title)
+                if not downloaded:
+                    # No image loaded: fall back to summarizing the result titles
+                    logger.warning(f"No image result could be downloaded for {query!r}")
+                    search_texts.extend(result.get('title', '') for result in results)
+                self._index_documents([{'text': result.get('title', ''), 'kind': 'image',
+                                        'query': query, 'url': result.get('image')} for result in results])
+            elif (indexed := self._indexed_texts(query)) is not None:
+                search_texts.extend(indexed)
+            else:
+                results = self.text_search(query)
+                search_texts.extend([result.get('body', '') for result in results])
+                self._index_documents([{'text': result.get('body', ''), 'kind': 'text',
+                                        'query': query, 'url': result.get('href')} for result in results])
 
         return search_images, search_texts
+
+    def _indexed_texts(self, query: str) -> Optional[List[str]]:
+        """
+        Serve a text search from the local vector index
+
+        Args:
+            query: Search query text
+
+        Returns:
+            Indexed snippets and image descriptions similar to the query, or
+            None when fewer than 'vector_index_min_hits' clear the similarity
+            threshold and the search has to go to the provider
+        """
+        if self.vector_index is None:
+            return None
+        with span("vector_index") as index_span:
+            try:
+                hits = self.vector_index.search(query,
+                                                k=self.config.get('max_results'),
+                                                threshold=self.config.get('vector_index_threshold', 0.8))
+            except Exception as e:
+                logger.warning(f"Vector index lookup failed, searching online: {e}")
+                return None
+            index_span.set(hits=len(hits))
+        if len(hits) < self.config.get('vector_index_min_hits', 1):
+            return None
+        return [record['text'] for _, record in hits]
+
+    def _index_documents(self, records: List[Dict[str, Any]]) -> None:
+        """Add retrieved documents to the vector index in the background"""
+        if self.vector_index is not None and records:
+            self._indexer.submit(self._add_to_index, self.vector_index, records)
+
+    @staticmethod
+    def _add_to_index(index: VectorIndex, records: List[Dict[str, Any]]) -> None:
+        try:
+            index.add(records)
+        except Exception as e:
+            logger.warning(f"Failed to index retrieved documents: {e}")
+
+
+class AsyncSearchService:
+    """Asyncio counterpart of SearchService.
+
+    DDGS and the image download are blocking, so each call is offloaded to
+    the default executor; this keeps the event loop free to drive many
+    conversations concurrently.
+    """
+    def __init__(self, service: Optional[SearchService] = None):
+        self.service = service or SearchService()
+
+    async def text_search(self, query: str) -> List[Dict[str, str]]:
+        """Asynchronously perform text-based search"""
+        return await asyncio.to_thread(self.service.text_search, query)
+
+    async def image_search(self,
+                           query: str,
+                           save_path: str,
+                           idx: int,
+                           conversation_num: int) -> Tuple[str, Optional[str], BytesIO]:
+        """Asynchronously perform image-based search and save the result"""
+        return await asyncio.to_thread(self.service.image_search, query, save_path, idx, conversation_num)
+
+    async def fine_search(self,
+                          query: str,
+                          search_type: str,
+                          save_path: str,
+                          dataset_name: str,
+                          idx: int,
+                          conversation_num: int) -> Tuple[List[Tuple[str, Optional[str], BytesIO]], List[str]]:
+        """Asynchronously perform a detailed search based on type"""
+        return await asyncio.to_thread(self.service.fine_search,
+                                       query, search_type, save_path, dataset_name, idx, conversation_num)
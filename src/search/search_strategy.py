@@ -2,83 +2,269 @@
 Strategy pattern for search options
 """
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
 from duckduckgo_search import DDGS
-import time
 from loguru import logger
-import requests
 from io import BytesIO
 from PIL import Image
 import os
+import threading
+
+from .http_client import get_http_client
+from .resilience import Retry
+from .scheduler import get_search_scheduler
 
 
 class SearchStrategy(ABC):
-    """Abstract base class for search strategies"""
-    def __init__(self, max_retries: int = 5, max_results: int = 5):
+    """Abstract base class for search strategies
+
+    Instances are shared across threads (see SearchFactory). Each thread keeps
+    its own long-lived DDGS client, since a DDGS session is not thread-safe,
+    and replaces it after a failed call because DDGS refuses further requests
+    once one has failed. Clients are closed when they are replaced, when their
+    thread has exited (checked whenever a new client is created) and by close().
+    """
+    # Circuit breaker / retry budget key shared by all instances of a strategy
+    endpoint = 'ddgs'
+    # Rate limit applied by the SearchScheduler ('search_qps' in SearchConfig)
+    search_type = 'text'
+
+    def __init__(self, max_retries: int = 5, max_results: int = 5, safesearch: str = 'Off'):
         self.max_retries = max_retries
         self.max_results = max_results
+        self.safesearch = safesearch
+        self._local = threading.local()
+        self._clients: Dict[threading.Thread, DDGS] = {}
+        self._clients_lock = threading.Lock()
 
     @abstractmethod
     def search(self, query: str) -> Any:
         """Execute the search strategy"""
         pass
 
+    def _client(self) -> DDGS:
+        """Return this thread's DDGS client, creating it on first use"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = DDGS()
+            with self._clients_lock:
+                # Threads of a pool that has shut down no longer need their clients
+                for thread in [thread for thread in self._clients if not thread.is_alive()]:
+                    self._close_client(self._clients.pop(thread))
+                self._clients[threading.current_thread()] = client
+        return client
+
+    def _discard_client(self) -> None:
+        client = getattr(self._local, 'client', None)
+        self._local.client = None
+        if client is not None:
+            with self._clients_lock:
+                if self._clients.get(threading.current_thread()) is client:
+                    del self._clients[threading.current_thread()]
+            self._close_client(client)
+
+    @staticmethod
+    def _close_client(client: DDGS) -> None:
+        try:
+            client.__exit__(None, None, None)
+        except Exception as e:
+            logger.debug(f"Failed to close DDGS client: {e}")
+
+    def close(self) -> None:
+        """Close the DDGS clients of all threads; call once the strategy is no longer used"""
+        with self._clients_lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            self._close_client(client)
+
     def _retry_operation(self, operation):
-        """Template method for retry logic"""
-        for i in range(self.max_retries):
+        """
+        Template method for retry logic (exponential backoff with jitter, see Retry)
+
+        Args:
+            operation: Callable receiving this thread's DDGS client
+        """
+        retry = Retry(self.endpoint, max_attempts=self.max_retries)
+        while True:
             try:
-                return operation()
+                retry.before_attempt()
+                get_search_scheduler().acquire(self.search_type)
+                result = operation(self._client())
+                retry.success()
+                return result
             except Exception as e:
-                logger.error(f"Attempt {i + 1} failed: {e}")
-                if i < self.max_retries - 1:
-                    time.sleep(2)
-                else:
+                logger.error(f"Attempt {retry.attempt} failed: {e}")
+                self._discard_client()
+                try:
+                    retry.failure(e)
+                except Exception:
                     logger.error("All retries failed.")
-                    raise ValueError(e)
+                    raise ValueError(e) from e
 
 
 class TextSearchStrategy(SearchStrategy):
     """Strategy for text-based search"""
+    endpoint = 'ddgs:text'
+    search_type = 'text'
+
     def search(self, query: str) -> List[Dict[str, str]]:
-        with DDGS() as ddgs:
-            return self._retry_operation(
-                lambda: ddgs.text(
-                    query,
-                    safesearch='Off',
-                    max_results=self.max_results
-                )
+        return self._retry_operation(
+            lambda ddgs: ddgs.text(
+                query,
+                safesearch=self.safesearch,
+                max_results=self.max_results
             )
+        )
 
 
 class ImageSearchStrategy(SearchStrategy):
     """Strategy for image-based search"""
-    def search(self, query: str) -> Dict[str, Any]:
-        with DDGS() as ddgs:
-            return self._retry_operation(
-                lambda: ddgs.images(
-                    query,
-                    safesearch='Off',
-                    max_results=self.max_results
-                )[0]
+    endpoint = 'ddgs:images'
+    search_type = 'image'
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        return self._retry_operation(
+            lambda ddgs: ddgs.images(
+                query,
+                safesearch=self.safesearch,
+                max_results=self.max_results
             )
+        )
 
 
 class ImageProcessor:
-    """Handles image processing and saving"""
+    """Handles image processing and saving
+
+    The downloaded bytes are kept in their original encoding and handed to
+    the vision model directly. Every image is decoded once to reject corrupt
+    or truncated files, but it is only re-encoded when it exceeds the
+    configured max resolution.
+    """
+    _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-writer')
+
+    @staticmethod
+    def prepare_image(data: bytes, max_resolution: Optional[int] = None) -> Tuple[bytes, str]:
+        """
+        Validate encoded image bytes and downscale them if necessary
+
+        Args:
+            data: Encoded image bytes
+            max_resolution: Maximum width/height accepted by the vision model
+
+        Returns:
+            Tuple of (encoded image bytes, file extension)
+        """
+        # Image.open only parses the header; load() decodes the pixels so that a
+        # truncated or corrupt image is rejected here rather than by the model
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+            image_format = image.format or 'PNG'
+            if max_resolution and max(image.size) > max_resolution:
+                image.thumbnail((max_resolution, max_resolution))
+                if image_format not in ('JPEG', 'PNG', 'WEBP'):
+                    image_format = 'PNG'
+                if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                output = BytesIO()
+                image.save(output, format=image_format)
+                data = output.getvalue()
+
+        extension = {'JPEG': 'jpg'}.get(image_format, image_format.lower())
+        return data, extension
+
     @staticmethod
-    def save_search_result(search_result: Dict[str, Any], save_path: str, idx: int, conversation_num: int) -> Tuple[str, str]:
+    def _write(path: str, data: bytes) -> None:
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"Failed to save image {path}: {e}")
+
+    @classmethod
+    def download_search_result(cls,
+                               search_result: Dict[str, Any],
+                               max_resolution: Optional[int] = None,
+                               timeout: Optional[float] = None) -> Tuple[str, bytes, str]:
+        """
+        Download and validate a search result image without saving it
+
+        Args:
+            search_result: Image search result
+            max_resolution: Maximum width/height accepted by the vision model
+            timeout: Request timeout in seconds, defaults to the HTTP client's
+
+        Returns:
+            Tuple of (image_url, encoded image bytes, file extension)
+        """
         image_url = search_result['image']
-        
-        response = requests.get(image_url)
+        kwargs = {'timeout': timeout} if timeout else {}
+        response = get_http_client().get(image_url, **kwargs)
         response.raise_for_status()
-        
-        image_bytes = BytesIO(response.content)
-        image = Image.open(image_bytes)
-        
-        save_image_path = os.path.join(
-            save_path,
-            f'{idx}_{conversation_num}_{search_result.get("position", "0")}.png'
-        )
-        image.save(save_image_path, format='PNG')
-        
-        return image_url, save_image_path
+
+        data, extension = cls.prepare_image(response.content, max_resolution)
+        return image_url, data, extension
+
+    @classmethod
+    def save_image(cls,
+                   data: bytes,
+                   extension: str,
+                   save_path: str,
+                   idx: int,
+                   conversation_num: int,
+                   position: Any) -> str:
+        """
+        Write encoded image bytes to disk in the background
+
+        Args:
+            data: Encoded image bytes
+            extension: File extension
+            save_path: Directory to save the image in
+            idx: Image index
+            conversation_num: Conversation number
+            position: Rank of the result, used in the file name
+
+        Returns:
+            Path the image is written to
+        """
+        save_image_path = os.path.join(save_path, f'{idx}_{conversation_num}_{position}.{extension}')
+        cls._writer.submit(cls._write, save_image_path, data)
+        return save_image_path
+
+    @classmethod
+    def save_search_result(cls,
+                           search_result: Dict[str, Any],
+                           save_path: str,
+                           idx: int,
+                           conversation_num: int,
+                           max_resolution: Optional[int] = None,
+                           save: bool = True,
+                           timeout: Optional[float] = None,
+                           position: Optional[int] = None) -> Tuple[str, Optional[str], BytesIO]:
+        """
+        Download a search result image
+
+        Args:
+            search_result: Image search result
+            save_path: Directory to save the image in
+            idx: Image index
+            conversation_num: Conversation number
+            max_resolution: Maximum width/height accepted by the vision model
+            save: Whether to also write the image to disk (in the background)
+            timeout: Request timeout in seconds, defaults to the HTTP client's
+            position: Rank of the result, used in the file name
+
+        Returns:
+            Tuple of (image_url, saved image path or None, in-memory image bytes)
+        """
+        if position is None:
+            position = search_result.get("position", "0")
+
+        image_url, data, extension = cls.download_search_result(search_result, max_resolution, timeout)
+
+        save_image_path = None
+        if save:
+            save_image_path = cls.save_image(data, extension, save_path, idx, conversation_num, position)
+
+        return image_url, save_image_path, BytesIO(data)
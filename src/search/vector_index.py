@@ -0,0 +1,265 @@
+"""
+Local embedding index over retrieved documents, shared across questions
+"""
+import os
+import json
+import atexit
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .search_config import SearchConfig
+from .resilience import Retry
+
+
+class OllamaEmbedder:
+    """Embeds texts with an Ollama embedding model"""
+    def __init__(self, host: Optional[str] = None, model: str = 'nomic-embed-text'):
+        try:
+            import ollama
+        except ImportError:
+            raise ValueError(
+                "The ollama python package is not installed. "
+                "Please install it with `pip install ollama`"
+            )
+
+        self.host = host or os.getenv("OLLAMA_HOST", "") or "http://localhost:11434"
+        self.model = model
+        self.endpoint = f"ollama:{self.host}"
+        self._client = ollama.Client(self.host)
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed a batch of texts
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            float32 array of shape (len(texts), dim)
+        """
+        retry = Retry(self.endpoint, max_attempts=3)
+        while True:
+            try:
+                retry.before_attempt()
+                response = self._client.embed(model=self.model, input=list(texts))
+                retry.success()
+                return np.asarray(response['embeddings'], dtype=np.float32)
+            except Exception as e:
+                retry.failure(e)
+
+
+class _NumpyBackend:
+    """Exact inner-product search over a growing matrix"""
+    def __init__(self, dim: int):
+        self._chunks: List[np.ndarray] = []
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+
+    def add(self, vectors: np.ndarray) -> None:
+        self._chunks.append(vectors)
+
+    def search(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self._chunks:
+            # Appends are batched into a single matrix on the next search
+            self._matrix = np.concatenate([self._matrix] + self._chunks)
+            self._chunks = []
+        if not len(self._matrix):
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        scores = self._matrix @ vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], top
+
+
+class _FaissBackend:
+    """FAISS HNSW index over inner products"""
+    def __init__(self, dim: int):
+        import faiss
+        self._index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+
+    def add(self, vectors: np.ndarray) -> None:
+        self._index.add(vectors)
+
+    def search(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores, ids = self._index.search(vector[None, :], k)
+        keep = ids[0] >= 0
+        return scores[0][keep], ids[0][keep]
+
+
+class _HnswBackend:
+    """hnswlib HNSW index over inner products"""
+    def __init__(self, dim: int, capacity: int = 1024):
+        import hnswlib
+        self._index = hnswlib.Index(space='ip', dim=dim)
+        self._index.init_index(max_elements=capacity, ef_construction=200, M=16)
+        self._index.set_ef(64)
+
+    def add(self, vectors: np.ndarray) -> None:
+        count = self._index.get_current_count()
+        if count + len(vectors) > self._index.get_max_elements():
+            self._index.resize_index(max(2 * self._index.get_max_elements(), count + len(vectors)))
+        self._index.add_items(vectors, np.arange(count, count + len(vectors)))
+
+    def search(self, vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, self._index.get_current_count())
+        if not k:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        ids, distances = self._index.knn_query(vector, k=k)
+        # hnswlib reports 1 - inner product as the distance
+        return 1 - distances[0], ids[0].astype(np.int64)
+
+
+_BACKENDS = {
+    'numpy': _NumpyBackend,
+    'faiss': _FaissBackend,
+    'hnsw': _HnswBackend,
+}
+
+
+class VectorIndex:
+    """In-memory embedding index of retrieved snippets and image descriptions.
+
+    Vectors are L2-normalized so inner products are cosine similarities. The
+    default backend is exact NumPy search; 'faiss' and 'hnsw' use approximate
+    HNSW search when faiss or hnswlib is installed and fall back to NumPy
+    otherwise. With persist_path set, the index is loaded from and saved to
+    a .npz file (on save() and at interpreter exit).
+    """
+    def __init__(self,
+                 embedder,
+                 backend: str = 'numpy',
+                 persist_path: Optional[str] = None):
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unsupported vector index backend: {backend}, expected one of {list(_BACKENDS)}")
+        self.embedder = embedder
+        self.backend_name = backend
+        self.persist_path = persist_path
+        self._backend = None
+        self._vectors: List[np.ndarray] = []
+        self._records: List[Dict[str, Any]] = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+        if persist_path:
+            if os.path.exists(persist_path):
+                self._load(persist_path)
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _make_backend(self, dim: int):
+        try:
+            return _BACKENDS[self.backend_name](dim)
+        except ImportError:
+            logger.warning(f"The {self.backend_name} vector index backend is not installed, "
+                           f"falling back to NumPy. Install it with `pip install "
+                           f"{'faiss-cpu' if self.backend_name == 'faiss' else 'hnswlib'}`")
+            self.backend_name = 'numpy'
+            return _NumpyBackend(dim)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _add_vectors(self, vectors: np.ndarray, records: List[Dict[str, Any]]) -> None:
+        if self._backend is None:
+            self._backend = self._make_backend(vectors.shape[1])
+        self._backend.add(vectors)
+        self._vectors.append(vectors)
+        self._records.extend(records)
+        self._seen.update(record['text'] for record in records)
+
+    def add(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Embed and index records not seen before
+
+        Args:
+            records: Dicts with a 'text' to embed plus any metadata
+                (e.g. kind, query, url) returned with search hits
+
+        Returns:
+            Number of records added
+        """
+        with self._lock:
+            new, texts = [], set()
+            for record in records:
+                text = record.get('text')
+                if text and text not in self._seen and text not in texts:
+                    texts.add(text)
+                    new.append(record)
+        if not new:
+            return 0
+
+        vectors = self._normalize(self.embedder([record['text'] for record in new]))
+        with self._lock:
+            # Another thread may have added the same texts while embedding
+            keep = [i for i, record in enumerate(new) if record['text'] not in self._seen]
+            if keep:
+                self._add_vectors(vectors[keep], [new[i] for i in keep])
+        return len(keep)
+
+    def search(self, query: str, k: int = 5, threshold: float = 0.0) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Find the records most similar to a query
+
+        Args:
+            query: Query text
+            k: Maximum number of hits
+            threshold: Minimum cosine similarity of a hit
+
+        Returns:
+            List of (similarity, record) pairs, most similar first
+        """
+        with self._lock:
+            if not self._records:
+                return []
+        vector = self._normalize(self.embedder([query])[0])
+        with self._lock:
+            scores, ids = self._backend.search(vector, k)
+            return [(float(score), self._records[i]) for score, i in zip(scores, ids) if score >= threshold]
+
+    def _load(self, path: str) -> None:
+        with np.load(path, allow_pickle=False) as data:
+            vectors = data['vectors']
+            records = json.loads(str(data['records']))
+        if len(records):
+            self._add_vectors(vectors, records)
+        logger.info(f"Loaded {len(records)} indexed documents from {path}")
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Write the index to path (defaults to persist_path) atomically"""
+        path = path or self.persist_path
+        if not path:
+            return
+        with self._lock:
+            if not self._records:
+                return
+            vectors = np.concatenate(self._vectors)
+            records = json.dumps(self._records, ensure_ascii=False)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, vectors=vectors, records=np.array(records))
+        os.replace(tmp_path, path)
+
+
+_vector_index = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index() -> Optional[VectorIndex]:
+    """Return the process-wide VectorIndex, or None when 'vector_index' is disabled in SearchConfig"""
+    global _vector_index
+    config = SearchConfig()
+    if not config.get('vector_index'):
+        return None
+    if _vector_index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                _vector_index = VectorIndex(OllamaEmbedder(model=config.get('embedding_model')),
+                                            backend=config.get('vector_index_backend', 'numpy'),
+                                            persist_path=config.get('vector_index_path'))
+    return _vector_index
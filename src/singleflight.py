@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+__all__ = ["SingleFlight",
+           "get_singleflight",
+           "singleflight_stats"]
+
+
+class SingleFlight:
+    """
+    并发相同请求的合并：同一个键的请求正在进行时，后来的调用方等待第一个请求的结果（或异常），
+    而不是重复发送。与缓存不同，请求结束后立即忘记该键，只在请求进行期间去重。
+
+    计数：
+        calls: 调用总数
+        hits: 直接使用了其他调用方进行中请求结果的调用数（即省下的请求数）
+        merges: 被多个调用方共享过的请求数
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, list] = {}
+        self._in_flight_async: Dict[Hashable, list] = {}
+        self.calls = 0
+        self.hits = 0
+        self.merges = 0
+
+    def _join(self, table, key, new_future):
+        """返回 (共享的 future, 是否为发起请求的一方)"""
+        with self._lock:
+            self.calls += 1
+            entry = table.get(key)
+            if entry is None:
+                table[key] = [new_future(), 1]
+                return table[key][0], True
+            entry[1] += 1
+            self.hits += 1
+            if entry[1] == 2:
+                self.merges += 1
+            return entry[0], False
+
+    def _leave(self, table, key):
+        with self._lock:
+            del table[key]
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """执行 fn()，同一个键已有进行中的请求时等待其结果"""
+        future, leader = self._join(self._in_flight, key, Future)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(self._in_flight, key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """do 的 asyncio 版本，fn 返回协程；同一个事件循环内的相同请求只执行一次"""
+        future, leader = self._join(self._in_flight_async, key, asyncio.get_running_loop().create_future)
+        if leader:
+            # 没有等待方时也标记异常已读取，避免 "exception was never retrieved" 警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        else:
+            # shield：等待方被取消时不影响发起方与其他等待方
+            return await asyncio.shield(future)
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        finally:
+            self._leave(self._in_flight_async, key)
+        future.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "hits": self.hits, "merges": self.merges}
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_singleflight(name: str) -> SingleFlight:
+    """返回进程内共享的、按名称区分的 SingleFlight（如 "ask_gpt"、"fine_search"）"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def singleflight_stats() -> dict:
+    """所有 SingleFlight 的计数，按名称索引"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+
+
+__all__ = ["Span",
+           "Trace",
+           "span",
+           "start_trace",
+           "current_spans",
+           "configure_tracing",
+           "tracing_enabled"]
+
+
+# 未开启追踪时 span() / start_trace() 只做一次布尔判断并返回共享的空对象
+_enabled = False
+_jsonl_path = None
+_otlp_path = None
+_export_lock = threading.Lock()
+
+# 当前的 trace 与 span，按线程 / asyncio 任务隔离；asyncio.to_thread 会复制上下文，
+# 提交到线程池的任务需要用 contextvars.copy_context().run 才能挂在同一个 trace 下
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+SERVICE_NAME = "open-omnisearch"
+
+
+def configure_tracing(enabled: bool = True, jsonl_path: Optional[str] = None, otlp_path: Optional[str] = None):
+    """
+    开启 / 关闭追踪。每个 trace 结束时：
+        jsonl_path: 每个 span 追加一行 JSON，可用 `python -m src.tracing <path>` 汇总；
+        otlp_path: 每个 trace 追加一行 OTLP/JSON（ExportTraceServiceRequest），
+            与 OpenTelemetry Collector 的 file exporter 格式一致。
+    """
+    global _enabled, _jsonl_path, _otlp_path
+    _enabled = enabled
+    _jsonl_path = jsonl_path
+    _otlp_path = otlp_path
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+class Span:
+    """一个计时区间；结束时以 dict 形式追加到所属 trace 的 spans 中"""
+    __slots__ = ("name", "trace", "span_id", "parent_id", "attributes", "start_ns", "_start", "_token")
+
+    def __init__(self, name: str, trace: "Trace", attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None and parent.trace is trace else None
+        self.attributes = attributes
+        self.start_ns = 0
+        self._start = 0.0
+        self._token = None
+
+    def set(self, **attributes) -> "Span":
+        """追加属性，值为 None 的属性忽略"""
+        for key, value in attributes.items():
+            if value is not None:
+                self.attributes[key] = value
+        return self
+
+    def set_usage(self, usage: dict) -> "Span":
+        """附加 LLM 返回的 token 统计（见 llm_config.get_last_usage）"""
+        return self.set(**usage)
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self._start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # 生成器在其他上下文中被关闭时无法 reset，直接清空当前 span
+            _current_span.set(None)
+        record = {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+        # GeneratorExit 等非 Exception 的退出（如提前关闭流式生成）不算错误
+        if exc_type is not None and issubclass(exc_type, Exception):
+            record["error"] = f"{exc_type.__name__}: {exc_val}"
+        self.trace.spans.append(record)
+        return False
+
+
+class Trace:
+    """一次对话的追踪，包含一个根 span；结束时导出全部 span"""
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self._root = Span(name, self, attributes)
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        self._root.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._root.__exit__(exc_type, exc_val, exc_tb)
+        try:
+            _current_trace.reset(self._token)
+        except ValueError:
+            _current_trace.set(None)
+        _export(self.spans)
+        return False
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空对象"""
+    spans = None
+
+    def set(self, **attributes):
+        return self
+
+    def set_usage(self, usage):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def start_trace(name: str, **attributes):
+    """开始一个新的 trace（通常对应一次对话），未开启追踪时返回空对象"""
+    if not _enabled:
+        return _NOOP
+    return Trace(name, attributes)
+
+
+def span(name: str, **attributes):
+    """
+    在当前 trace 下记录一个阶段的耗时：
+        with span("search", search_type=search_type) as s:
+            ...
+            s.set(hits=len(results))
+    未开启追踪或不在任何 trace 中时返回空对象，几乎没有开销。
+    """
+    if not _enabled:
+        return _NOOP
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    return Span(name, trace, attributes)
+
+
+def current_spans():
+    """当前 trace 已结束的 span 列表（之后结束的 span 会继续追加），不在 trace 中时返回 None"""
+    trace = _current_trace.get() if _enabled else None
+    return trace.spans if trace is not None else None
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans) -> dict:
+    """把 span 记录转换为 OTLP/JSON 的 ExportTraceServiceRequest"""
+    otlp_spans = []
+    for record in spans:
+        end_ns = record["start_ns"] + int(record["duration_ms"] * 1e6)
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(record["start_ns"]),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in record["attributes"].items()],
+            "status": {"code": 2, "message": record["error"]} if "error" in record else {"code": 1},
+        }
+        if record["parent_id"]:
+            otlp_span["parentSpanId"] = record["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+        }]
+    }
+
+
+def _export(spans):
+    if not spans or (_jsonl_path is None and _otlp_path is None):
+        return
+    spans = list(spans)
+    with _export_lock:
+        if _jsonl_path is not None:
+            with open(_jsonl_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in spans))
+        if _otlp_path is not None:
+            with open(_otlp_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(to_otlp(spans), ensure_ascii=False) + "\n")
+
+
+def _percentile(sorted_values, q):
+    """最近秩法求分位数"""
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(paths):
+    """按阶段汇总 span 耗时（p50 / p95 / p99）以及 token 数"""
+    durations = defaultdict(list)
+    tokens = defaultdict(lambda: [0, 0])
+    errors = defaultdict(int)
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                name = record["name"]
+                durations[name].append(record["duration_ms"])
+                tokens[name][0] += record["attributes"].get("prompt_eval_count", 0)
+                tokens[name][1] += record["attributes"].get("eval_count", 0)
+                errors[name] += "error" in record
+
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append((name, len(values), errors[name], sum(values) / len(values),
+                     _percentile(values, 50), _percentile(values, 95), _percentile(values, 99),
+                     tokens[name][0], tokens[name][1]))
+    rows.sort(key=lambda row: -row[1] * row[3])
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="汇总追踪 JSONL 中各阶段的耗时分位数")
+    parser.add_argument("paths", nargs="+", help="configure_tracing(jsonl_path=...) 写出的文件")
+    args = parser.parse_args(argv)
+
+    header = ("stage", "count", "errors", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "prompt_tok", "eval_tok")
+    print("{:<20} {:>7} {:>6} {:>10} {:>10} {:>10} {:>10} {:>11} {:>9}".format(*header))
+    for row in summarize(args.paths):
+        print("{:<20} {:>7} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>11} {:>9}".format(*row))
+
+
+if __name__ == "__main__":
+    sys.exit(main())